@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Activity, HealthMetrics
+from .models import Activity, ActivityMonthlySummary, HealthMetrics, HealthMetricsMonthlySummary
 
 @admin.register(Activity)
 class ActivityAdmin(admin.ModelAdmin):
@@ -8,9 +8,21 @@ class ActivityAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'activity_type', 'external_id')
     date_hierarchy = 'date'
 
+@admin.register(ActivityMonthlySummary)
+class ActivityMonthlySummaryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'source', 'month', 'total_activities', 'total_distance', 'total_duration')
+    list_filter = ('source', 'month')
+    search_fields = ('user__username',)
+
 @admin.register(HealthMetrics)
 class HealthMetricsAdmin(admin.ModelAdmin):
     list_display = ('user', 'date', 'resting_heart_rate', 'hrv', 'recovery_score', 'source')
     list_filter = ('source', 'date')
     search_fields = ('user__username',)
-    date_hierarchy = 'date' 
\ No newline at end of file
+    date_hierarchy = 'date' 
+
+@admin.register(HealthMetricsMonthlySummary)
+class HealthMetricsMonthlySummaryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'source', 'month', 'days', 'avg_rhr', 'avg_hrv', 'avg_recovery', 'total_sleep')
+    list_filter = ('source', 'month')
+    search_fields = ('user__username',)
@@ -0,0 +1,50 @@
+import logging
+import time
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Views cache what they computed for a user under the user's current version. Writers bump the
+# version instead of deleting entries, so a page is never served from data older than the
+# last write. If Redis is unavailable pages are computed every time.
+
+def _version_key(user_id):
+    return f"dashboard-version:{user_id}"
+
+def get_version(user_id):
+    """The user's current cache version, starting one if there is none"""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1 so a version lost from Redis is never reused
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+def bump_version(user_id):
+    """Invalidate everything cached for the user"""
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), time.time_ns(), timeout=None)
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump dashboard cache version for user {user_id}: {str(e)}")
+
+def get_or_compute(user_id, key, compute):
+    """Return the value cached for the user under `key`, calling `compute` to fill it on a miss"""
+    try:
+        version = get_version(user_id)
+        value = cache.get(f"dashboard:{user_id}:{key}", version=version)
+    except redis.RedisError as e:
+        logger.warning(f"Dashboard cache unavailable, computing {key} for user {user_id}: {str(e)}")
+        return compute()
+
+    if value is None:
+        value = compute()
+        try:
+            cache.set(f"dashboard:{user_id}:{key}", value, timeout=settings.DASHBOARD_CACHE_TIMEOUT, version=version)
+        except redis.RedisError as e:
+            logger.warning(f"Could not cache {key} for user {user_id}: {str(e)}")
+    return value
@@ -0,0 +1,92 @@
+import logging
+from django.db import transaction
+from .dashboard_cache import bump_version
+from .models import Activity, HealthMetrics
+from .rollups import ActivitySummaries, HealthMetricsSummaries, lock_summaries
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+def upsert_activities(user, source, rows):
+    """
+    Insert or update a batch of activities for one user and source.
+
+    Each row is a dict of Activity field values including `external_id`. Fields missing from a
+    row are left untouched on existing activities.
+    Returns a dict with the number of activities created and updated.
+    """
+    return _bulk_upsert(Activity, user, source, 'external_id', rows, summaries=ActivitySummaries)
+
+def delete_activities(user, source, external_ids):
+    """Delete a user's activities from one source by external id. Returns the number deleted."""
+    with transaction.atomic():
+        lock_summaries(user)
+        activities = Activity.objects.filter(user=user, source=source, external_id__in=list(external_ids))
+        removed = list(activities.values(*ActivitySummaries.fields))
+        deleted, _ = activities.delete()
+        ActivitySummaries.update(user, source, removed=removed, added=[])
+        if deleted:
+            transaction.on_commit(lambda: bump_version(user.id))
+    return deleted
+
+def upsert_health_metrics(user, source, rows):
+    """
+    Insert or update a batch of daily health metrics for one user and source.
+
+    Each row is a dict of HealthMetrics field values including `date`. Fields missing from a
+    row are left untouched on existing days.
+    Returns a dict with the number of days created and updated.
+    """
+    return _bulk_upsert(HealthMetrics, user, source, 'date', rows, summaries=HealthMetricsSummaries)
+
+def _bulk_upsert(model, user, source, key_field, rows, summaries=None):
+    # Collapse repeated keys within the batch, later rows taking precedence
+    merged = {}
+    for row in rows:
+        merged.setdefault(row[key_field], {}).update(row)
+
+    if not merged:
+        return {'created': 0, 'updated': 0}
+
+    # Rows providing the same fields can share one INSERT ... ON CONFLICT DO UPDATE statement
+    groups = {}
+    for key, row in merged.items():
+        fields = tuple(sorted(field for field in row if field != key_field))
+        groups.setdefault(fields, []).append(row)
+
+    with transaction.atomic():
+        existing = model.objects.filter(user=user, source=source, **{f'{key_field}__in': list(merged)})
+        if summaries:
+            # The summaries are adjusted by what each existing row looked like before this write
+            lock_summaries(user)
+            existing = {row[key_field]: row for row in existing.values(key_field, *summaries.fields)}
+        else:
+            existing = set(existing.values_list(key_field, flat=True))
+
+        for fields, group in groups.items():
+            objects = [model(user=user, source=source, **row) for row in group]
+            if not fields:
+                model.objects.bulk_create(objects, batch_size=BATCH_SIZE, ignore_conflicts=True)
+                continue
+            model.objects.bulk_create(
+                objects,
+                batch_size=BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['user', 'source', key_field],
+                update_fields=list(fields),
+            )
+
+        if summaries:
+            added = [
+                {**existing.get(key, {}), **{field: row[field] for field in summaries.fields if field in row}}
+                for key, row in merged.items()
+            ]
+            summaries.update(user, source, removed=list(existing.values()), added=added)
+
+        # Cached pages are only invalidated once the new rows are visible to readers
+        transaction.on_commit(lambda: bump_version(user.id))
+
+    created = len(merged) - len(existing)
+    logger.info(f"Upserted {len(merged)} {model._meta.verbose_name_plural} for user {user.username} from {source}: {created} created, {len(existing)} updated")
+    return {'created': created, 'updated': len(existing)}
@@ -0,0 +1,135 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from integrations.models import UserIntegration
+from core.models import Activity, HealthMetrics
+import random
+import statistics
+import time
+from datetime import timedelta
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'benchmark-'
+# Not one of the SYNC_PROVIDERS, so the scheduler and token refresher leave these integrations alone
+PROVIDER = 'benchmark'
+
+class Command(BaseCommand):
+    help = 'Print query plans and timings for the hot activity and metrics queries against a synthetic dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activities', type=int, default=1_000_000, help='Number of synthetic activities, defaults to 1,000,000')
+        parser.add_argument('--users', type=int, default=1000, help='Number of synthetic users, defaults to 1000')
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per query, defaults to 20')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic data for another run instead of deleting it')
+
+    def handle(self, *args, **kwargs):
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+        if users:
+            self.stdout.write(f'Reusing synthetic data for {len(users)} users')
+        else:
+            users = self.create_dataset(kwargs['users'], kwargs['activities'])
+
+        try:
+            user = users[len(users) // 2]
+            self.benchmark(user, kwargs['runs'])
+        finally:
+            if not kwargs['keep']:
+                self.delete_dataset()
+
+    def create_dataset(self, user_count, activity_count):
+        self.stdout.write(f'Creating {activity_count} activities for {user_count} synthetic users...')
+        start_time = time.time()
+        now = timezone.now()
+
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=f'{USERNAME_PREFIX}{n}', password='!')
+                for n in range(user_count)
+            ])
+            users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+            UserIntegration.objects.bulk_create([
+                UserIntegration(
+                    user=user,
+                    provider=PROVIDER,
+                    access_token='benchmark',
+                    refresh_token='benchmark',
+                    token_expires_at=now,
+                    external_id=str(user.id)
+                )
+                for user in users
+            ])
+
+        per_user = max(1, activity_count // user_count)
+        batch = []
+        for user in users:
+            for n in range(per_user):
+                batch.append(Activity(
+                    user=user,
+                    source=random.choice(('strava', 'strava', 'whoop')),
+                    external_id=f'{user.id}-{n}',
+                    date=now - timedelta(hours=random.randint(0, 5 * 365 * 24)),
+                    activity_type=random.choice(('Run', 'Ride', 'Swim', 'Workout')),
+                    duration=timedelta(minutes=random.randint(10, 180)),
+                    distance=random.uniform(0, 100),
+                ))
+                if len(batch) >= 10000:
+                    Activity.objects.bulk_create(batch)
+                    batch = []
+            HealthMetrics.objects.bulk_create([
+                HealthMetrics(user=user, source='whoop', date=(now - timedelta(days=day)).date(), hrv=random.uniform(20, 120))
+                for day in range(365)
+            ])
+        Activity.objects.bulk_create(batch)
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(f'Created synthetic data in {time.time() - start_time:.1f} seconds')
+        return users
+
+    def delete_dataset(self):
+        self.stdout.write('Deleting synthetic data...')
+        benchmark_users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        Activity.objects.filter(user__in=benchmark_users).delete()
+        HealthMetrics.objects.filter(user__in=benchmark_users).delete()
+        benchmark_users.delete()
+
+    def queries(self, user):
+        now = timezone.now()
+        month_start = (now - timedelta(days=60)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        external_ids = [f'{user.id}-{n}' for n in range(0, 400, 2)]
+
+        return [
+            ('Latest Strava activities', Activity.objects.filter(user=user, source='strava').order_by('-date')[:50]),
+            ('Strava month of activities', Activity.objects.filter(user=user, source='strava', date__gte=month_start, date__lt=month_end).order_by('-date')),
+            ('Strava month stats', Activity.objects.filter(user=user, source='strava', date__gte=month_start, date__lt=month_end).values('user').annotate(
+                total_activities=Count('id'), total_distance=Sum('distance'), total_duration=Sum('duration'))),
+            ('Upsert key lookup', Activity.objects.filter(user=user, source='strava', external_id__in=external_ids).values('external_id', 'summary_fingerprint')),
+            ('Has activities', Activity.objects.filter(user=user).values('id')[:1]),
+            ('Whoop month of metrics', HealthMetrics.objects.filter(user=user, source='whoop', date__gte=month_start.date(), date__lt=month_end.date()).order_by('-date')),
+            ('Webhook integration lookup', UserIntegration.objects.filter(provider=PROVIDER, external_id=str(user.id))),
+        ]
+
+    def benchmark(self, user, runs):
+        analyze = connection.vendor == 'postgresql'
+        self.stdout.write(f'Benchmarking against {Activity.objects.count()} activities on {connection.vendor}, {runs} runs per query\n')
+
+        for name, queryset in self.queries(user):
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain(analyze=True) if analyze else queryset.explain())
+
+            timings = []
+            for _ in range(runs):
+                start_time = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start_time) * 1000)
+            self.stdout.write(
+                f'median {statistics.median(timings):.2f} ms, '
+                f'p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:.2f} ms, '
+                f'max {max(timings):.2f} ms\n'
+            )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from core.rollups import rebuild_activity_summaries, rebuild_health_metrics_summaries
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly activity and health metrics summaries from the stored data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=str, help='Username to rebuild summaries for, defaults to every user')
+
+    def handle(self, *args, **kwargs):
+        username = kwargs.get('user')
+
+        if username:
+            try:
+                users = [User.objects.get(username=username)]
+            except User.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f'User {username} not found'))
+                return
+        else:
+            users = User.objects.order_by('id').iterator()
+
+        total_users = total_months = 0
+        for user in users:
+            activity_months = rebuild_activity_summaries(user)
+            metrics_months = rebuild_health_metrics_summaries(user)
+            total_users += 1
+            total_months += activity_months + metrics_months
+            self.stdout.write(f'Rebuilt {activity_months} activity months and {metrics_months} health metrics months for user {user.username}')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total_months} monthly summaries for {total_users} users'))
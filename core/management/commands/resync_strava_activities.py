@@ -5,7 +5,9 @@ from integrations.services.strava import StravaService
 from core.models import Activity
 import logging
 import time
-from datetime import datetime, timedelta
+from datetime import timedelta
+from django.utils import timezone
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -16,6 +18,7 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--days', type=int, help='Number of days to go back for resync, defaults to all activities')
         parser.add_argument('--user', type=str, help='Username to sync, defaults to all users')
+        parser.add_argument('--concurrency', type=int, help='Number of activity details to fetch at once, defaults to STRAVA_DETAIL_CONCURRENCY')
 
     def handle(self, *args, **kwargs):
         self.stdout.write('Starting full Strava activities resync with detailed data...')
@@ -44,33 +47,22 @@ class Command(BaseCommand):
             
             try:
                 # Get the service
-                service = StravaService(user)
+                service = StravaService(user, detail_concurrency=kwargs.get('concurrency'))
                 
-                # Store original last_sync
-                old_last_sync = integration.last_sync
-                
-                # Determine how far back to sync
+                # Determine how far back to sync. The sync restarts from last_sync and saves its
+                # cursor after every page, so an interrupted resync resumes on the next sync.
+                cutoff_date = None
                 if days:
-                    # Set last_sync to specified days ago
-                    cutoff_date = datetime.now() - timedelta(days=days)
-                    integration.last_sync = cutoff_date
+                    cutoff_date = timezone.now() - timedelta(days=days)
                     self.stdout.write(f'Syncing activities from {cutoff_date} onwards')
                 else:
-                    # Set to None to get all activities
-                    integration.last_sync = None
                     self.stdout.write('Syncing all activities (no date limit)')
                 
-                integration.save()
-                
-                # Get full activity history
+                # Get full activity history, waiting for any sync already running for the user
                 start_time = time.time()
-                result = service.sync_activities()
+                result = service.resync_activities(cutoff_date, lock_wait=settings.SYNC_LOCK_WAIT)
                 end_time = time.time()
                 
-                # Restore the original last_sync time
-                integration.last_sync = old_last_sync
-                integration.save()
-                
                 # Report results
                 self.stdout.write(f'User {user.username}: {result["total"]} activities processed')
                 self.stdout.write(f'Heart rate data available for {result["heart_rate"]} activities')
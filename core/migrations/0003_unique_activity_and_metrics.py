@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:27
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    """Keep only the newest row for each key before the unique constraints are added"""
+    for model_name, key_fields in (
+        ('Activity', ('user', 'source', 'external_id')),
+        ('HealthMetrics', ('user', 'source', 'date')),
+    ):
+        model = apps.get_model('core', model_name)
+        duplicates = (
+            model.objects.values(*key_fields)
+            .annotate(row_count=Count('id'), keep_id=Max('id'))
+            .filter(row_count__gt=1)
+        )
+        for duplicate in duplicates:
+            keep_id = duplicate.pop('keep_id')
+            duplicate.pop('row_count')
+            model.objects.filter(**duplicate).exclude(id=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_activity_average_cadence_activity_average_heart_rate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='activity',
+            unique_together={('user', 'source', 'external_id')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='healthmetrics',
+            unique_together={('user', 'source', 'date')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_unique_activity_and_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='summary_fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
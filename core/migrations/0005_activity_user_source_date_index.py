@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_activity_summary_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', 'source', '-date'], name='activity_user_source_date_idx'),
+        ),
+    ]
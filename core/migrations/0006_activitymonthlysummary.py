@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:47
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def build_summaries(apps, schema_editor):
+    """Fill the summaries from the activities already stored"""
+    Activity = apps.get_model('core', 'Activity')
+    ActivityMonthlySummary = apps.get_model('core', 'ActivityMonthlySummary')
+    totals = (
+        Activity.objects.annotate(month=TruncMonth('date'))
+        .values('user_id', 'source', 'month', 'activity_type')
+        .annotate(activities=Count('id'), distance=Sum('distance'), duration=Sum('duration'))
+        .order_by()
+    )
+    summaries = {}
+    for total in totals:
+        key = (total['user_id'], total['source'], total['month'].date())
+        if key not in summaries:
+            summaries[key] = ActivityMonthlySummary(
+                user_id=key[0], source=key[1], month=key[2],
+                total_activities=0, total_distance=0, total_duration=datetime.timedelta(), activity_types={}
+            )
+        summary = summaries[key]
+        summary.total_activities += total['activities']
+        summary.total_distance += total['distance'] or 0
+        summary.total_duration += total['duration'] or datetime.timedelta()
+        summary.activity_types[total['activity_type']] = total['activities']
+    ActivityMonthlySummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_activity_user_source_date_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=20)),
+                ('month', models.DateField()),
+                ('total_activities', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+                ('total_duration', models.DurationField(default=datetime.timedelta)),
+                ('activity_types', models.JSONField(default=dict)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'activity monthly summaries',
+                'unique_together': {('user', 'source', 'month')},
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
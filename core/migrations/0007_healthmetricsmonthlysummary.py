@@ -0,0 +1,65 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:49
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def build_summaries(apps, schema_editor):
+    """Fill the summaries from the daily metrics already stored"""
+    HealthMetrics = apps.get_model('core', 'HealthMetrics')
+    HealthMetricsMonthlySummary = apps.get_model('core', 'HealthMetricsMonthlySummary')
+    aggregates = {'days': Count('id')}
+    for measure in ('resting_heart_rate', 'hrv', 'recovery_score', 'sleep_duration'):
+        aggregates[f'{measure}_total'] = Sum(measure)
+        aggregates[f'{measure}_count'] = Count(measure)
+    totals = (
+        HealthMetrics.objects.annotate(month=TruncMonth('date'))
+        .values('user_id', 'source', 'month')
+        .annotate(**aggregates)
+        .order_by()
+    )
+    HealthMetricsMonthlySummary.objects.bulk_create(
+        [
+            HealthMetricsMonthlySummary(**{field: value for field, value in total.items() if value is not None})
+            for total in totals
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_activitymonthlysummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HealthMetricsMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=20)),
+                ('month', models.DateField()),
+                ('days', models.IntegerField(default=0)),
+                ('resting_heart_rate_total', models.FloatField(default=0)),
+                ('resting_heart_rate_count', models.IntegerField(default=0)),
+                ('hrv_total', models.FloatField(default=0)),
+                ('hrv_count', models.IntegerField(default=0)),
+                ('recovery_score_total', models.FloatField(default=0)),
+                ('recovery_score_count', models.IntegerField(default=0)),
+                ('sleep_duration_total', models.DurationField(default=datetime.timedelta)),
+                ('sleep_duration_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'health metrics monthly summaries',
+                'unique_together': {('user', 'source', 'month')},
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from django.db import models
 from django.conf import settings
 
@@ -12,9 +13,29 @@ class Activity(models.Model):
     average_cadence = models.IntegerField(null=True, blank=True)
     source = models.CharField(max_length=20)  # 'strava' or 'whoop'
     external_id = models.CharField(max_length=100)
+    summary_fingerprint = models.CharField(max_length=64, null=True, blank=True)  # Hash of the provider's summary payload
     
     class Meta:
         verbose_name_plural = 'activities'
+        unique_together = ('user', 'source', 'external_id')
+        indexes = [
+            # Activity lists and monthly stats filter on user and source and sort by date
+            models.Index(fields=['user', 'source', '-date'], name='activity_user_source_date_idx'),
+        ]
+
+class ActivityMonthlySummary(models.Model):
+    """Per-month activity totals, kept up to date by core.ingest as activities are written"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    source = models.CharField(max_length=20)
+    month = models.DateField()  # First day of the month in the TIME_ZONE setting's time zone
+    total_activities = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0)
+    total_duration = models.DurationField(default=timedelta)
+    activity_types = models.JSONField(default=dict)  # Activity count by type
+
+    class Meta:
+        verbose_name_plural = 'activity monthly summaries'
+        unique_together = ('user', 'source', 'month')
 
 class HealthMetrics(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -26,4 +47,45 @@ class HealthMetrics(models.Model):
     source = models.CharField(max_length=20)  # 'whoop'
     
     class Meta:
-        verbose_name_plural = 'health metrics' 
\ No newline at end of file
+        verbose_name_plural = 'health metrics'
+        unique_together = ('user', 'source', 'date')
+
+class HealthMetricsMonthlySummary(models.Model):
+    """
+    Per-month running totals and counts of daily health metrics, kept up to date by core.ingest.
+
+    Each measure keeps its own count because a day may be missing some measures, e.g. a
+    recovery without a sleep.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    source = models.CharField(max_length=20)
+    month = models.DateField()  # First day of the month
+    days = models.IntegerField(default=0)
+    resting_heart_rate_total = models.FloatField(default=0)
+    resting_heart_rate_count = models.IntegerField(default=0)
+    hrv_total = models.FloatField(default=0)
+    hrv_count = models.IntegerField(default=0)
+    recovery_score_total = models.FloatField(default=0)
+    recovery_score_count = models.IntegerField(default=0)
+    sleep_duration_total = models.DurationField(default=timedelta)
+    sleep_duration_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'health metrics monthly summaries'
+        unique_together = ('user', 'source', 'month')
+
+    @property
+    def avg_rhr(self):
+        return self.resting_heart_rate_total / self.resting_heart_rate_count if self.resting_heart_rate_count else 0
+
+    @property
+    def avg_hrv(self):
+        return self.hrv_total / self.hrv_count if self.hrv_count else 0
+
+    @property
+    def avg_recovery(self):
+        return self.recovery_score_total / self.recovery_score_count if self.recovery_score_count else 0
+
+    @property
+    def total_sleep(self):
+        return self.sleep_duration_total
@@ -0,0 +1,183 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .dashboard_cache import bump_version
+from .models import Activity, ActivityMonthlySummary, HealthMetrics, HealthMetricsMonthlySummary
+
+logger = logging.getLogger(__name__)
+
+# HealthMetrics fields whose running totals and counts HealthMetricsMonthlySummary keeps
+HEALTH_MEASURES = ('resting_heart_rate', 'hrv', 'recovery_score', 'sleep_duration')
+
+def month_of(value):
+    """The first day of the month a date or datetime falls in, in the TIME_ZONE setting's time zone as TruncMonth uses"""
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        value = value.date()
+    return value.replace(day=1)
+
+def lock_summaries(user):
+    """
+    Serialise summary maintenance for one user until the current transaction ends.
+
+    Incremental updates read the rows they replace after taking this lock, so two writers, or a
+    writer and a rebuild, cannot apply their changes on top of a stale view of the same months.
+    """
+    list(get_user_model().objects.select_for_update().filter(pk=user.pk).values_list('pk'))
+
+def _bump(delta, key, value):
+    delta[key] = delta[key] + value if key in delta else value
+
+class MonthlySummaries:
+    """
+    Keeps a monthly summary model in step with writes to the model it summarises.
+
+    Writers pass the rows they replaced or deleted as `removed` and the rows as they now stand
+    as `added`, both as dicts holding at least `fields`. Subclasses define the classmethod
+    `add(delta, row, sign)`, which adds `sign` times a row's contribution to its month's delta.
+    Only the months the rows fall in are touched, so the cost does not depend on the user's
+    history. A month whose `count_field` drops to zero is deleted.
+    """
+    model = None
+    fields = ()
+    count_field = None
+
+    @classmethod
+    def update(cls, user, source, removed, added):
+        deltas = {}
+        for rows, sign in ((removed, -1), (added, 1)):
+            for row in rows:
+                cls.add(deltas.setdefault(month_of(row['date']), {}), row, sign)
+
+        # Revisions that did not change anything the summaries count cancel out
+        deltas = {month: delta for month, delta in deltas.items() if any(delta.values())}
+        if not deltas:
+            return
+
+        summaries = {
+            summary.month: summary
+            for summary in cls.model.objects.filter(user=user, source=source, month__in=list(deltas))
+        }
+        created, changed, emptied = [], [], []
+        update_fields = set()
+        for month, delta in deltas.items():
+            summary = summaries.get(month) or cls.model(user=user, source=source, month=month)
+            for key, value in delta.items():
+                if isinstance(key, tuple):
+                    # A count within a JSON field, e.g. ('activity_types', 'Run')
+                    field, name = key
+                    counts = Counter(getattr(summary, field))
+                    counts[name] += value
+                    setattr(summary, field, {name: count for name, count in counts.items() if count > 0})
+                else:
+                    field = key
+                    setattr(summary, field, getattr(summary, field) + value)
+                update_fields.add(field)
+
+            if getattr(summary, cls.count_field) > 0:
+                (changed if summary.pk else created).append(summary)
+            elif summary.pk:
+                emptied.append(summary.pk)
+
+        cls.model.objects.bulk_create(created)
+        cls.model.objects.bulk_update(changed, sorted(update_fields))
+        if emptied:
+            cls.model.objects.filter(pk__in=emptied).delete()
+
+class ActivitySummaries(MonthlySummaries):
+    """Maintains ActivityMonthlySummary as activities are written"""
+    model = ActivityMonthlySummary
+    fields = ('date', 'activity_type', 'distance', 'duration')
+    count_field = 'total_activities'
+
+    @classmethod
+    def add(cls, delta, row, sign):
+        _bump(delta, 'total_activities', sign)
+        _bump(delta, 'total_distance', sign * (row.get('distance') or 0))
+        _bump(delta, 'total_duration', sign * (row.get('duration') or timedelta()))
+        _bump(delta, ('activity_types', row['activity_type']), sign)
+
+class HealthMetricsSummaries(MonthlySummaries):
+    """Maintains HealthMetricsMonthlySummary as daily metrics are written"""
+    model = HealthMetricsMonthlySummary
+    fields = ('date',) + HEALTH_MEASURES
+    count_field = 'days'
+
+    @classmethod
+    def add(cls, delta, row, sign):
+        _bump(delta, 'days', sign)
+        for measure in HEALTH_MEASURES:
+            if row.get(measure) is not None:
+                _bump(delta, f'{measure}_total', sign * row[measure])
+                _bump(delta, f'{measure}_count', sign)
+
+def rebuild_activity_summaries(user):
+    """Recompute all of a user's ActivityMonthlySummary rows from their activities. Returns the number of months."""
+    with transaction.atomic():
+        lock_summaries(user)
+        ActivityMonthlySummary.objects.filter(user=user).delete()
+
+        summaries = {}
+        totals = (
+            Activity.objects.filter(user=user)
+            .annotate(month=TruncMonth('date'))
+            .values('source', 'month', 'activity_type')
+            .annotate(activities=Count('id'), distance=Sum('distance'), duration=Sum('duration'))
+            .order_by()
+        )
+        for total in totals:
+            month = month_of(total['month'])
+            summary = summaries.get((total['source'], month))
+            if summary is None:
+                summary = summaries[(total['source'], month)] = ActivityMonthlySummary(
+                    user=user, source=total['source'], month=month
+                )
+            summary.total_activities += total['activities']
+            summary.total_distance += total['distance'] or 0
+            summary.total_duration += total['duration'] or timedelta()
+            summary.activity_types[total['activity_type']] = total['activities']
+
+        ActivityMonthlySummary.objects.bulk_create(summaries.values(), batch_size=500)
+        transaction.on_commit(lambda: bump_version(user.id))
+
+    logger.info(f"Rebuilt {len(summaries)} monthly activity summaries for user {user.username}")
+    return len(summaries)
+
+def rebuild_health_metrics_summaries(user):
+    """Recompute all of a user's HealthMetricsMonthlySummary rows from their daily metrics. Returns the number of months."""
+    aggregates = {'days': Count('id')}
+    for measure in HEALTH_MEASURES:
+        aggregates[f'{measure}_total'] = Sum(measure)
+        aggregates[f'{measure}_count'] = Count(measure)
+
+    with transaction.atomic():
+        lock_summaries(user)
+        HealthMetricsMonthlySummary.objects.filter(user=user).delete()
+
+        totals = (
+            HealthMetrics.objects.filter(user=user)
+            .annotate(month=TruncMonth('date'))
+            .values('source', 'month')
+            .annotate(**aggregates)
+            .order_by()
+        )
+        summaries = [
+            HealthMetricsMonthlySummary(
+                user=user,
+                source=total.pop('source'),
+                month=month_of(total.pop('month')),
+                **{field: value for field, value in total.items() if value is not None}
+            )
+            for total in totals
+        ]
+        HealthMetricsMonthlySummary.objects.bulk_create(summaries, batch_size=500)
+        transaction.on_commit(lambda: bump_version(user.id))
+
+    logger.info(f"Rebuilt {len(summaries)} monthly health metrics summaries for user {user.username}")
+    return len(summaries)
@@ -0,0 +1,91 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from .ingest import delete_activities, upsert_activities, upsert_health_metrics
+from .models import ActivityMonthlySummary, HealthMetricsMonthlySummary
+from .rollups import rebuild_activity_summaries, rebuild_health_metrics_summaries
+
+def activity(external_id, day, activity_type='Run', distance=5.0, minutes=30):
+    return {
+        'external_id': external_id,
+        'date': datetime(2024, 1, 1, 12, tzinfo=dt_timezone.utc) + timedelta(days=day),
+        'activity_type': activity_type,
+        'distance': distance,
+        'duration': timedelta(minutes=minutes),
+    }
+
+def summaries(model, fields):
+    return sorted(model.objects.values_list('source', 'month', *fields))
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MonthlySummaryTests(TestCase):
+    """The summaries kept up to date by core.ingest must match a rebuild from the rows themselves"""
+
+    activity_fields = ('total_activities', 'total_distance', 'total_duration', 'activity_types')
+    metrics_fields = (
+        'days', 'resting_heart_rate_total', 'resting_heart_rate_count', 'hrv_total', 'hrv_count',
+        'recovery_score_total', 'recovery_score_count', 'sleep_duration_total', 'sleep_duration_count',
+    )
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='athlete')
+
+    def assertActivitySummariesMatchRebuild(self):
+        incremental = summaries(ActivityMonthlySummary, self.activity_fields)
+        rebuild_activity_summaries(self.user)
+        self.assertEqual(incremental, summaries(ActivityMonthlySummary, self.activity_fields))
+
+    def assertMetricsSummariesMatchRebuild(self):
+        incremental = summaries(HealthMetricsMonthlySummary, self.metrics_fields)
+        rebuild_health_metrics_summaries(self.user)
+        self.assertEqual(incremental, summaries(HealthMetricsMonthlySummary, self.metrics_fields))
+
+    def test_activity_summaries_follow_inserts_revisions_and_deletes(self):
+        upsert_activities(self.user, 'strava', [activity(str(n), n * 3) for n in range(40)])
+        upsert_activities(self.user, 'whoop', [activity('w1', 2, 'Workout', distance=0)])
+        self.assertActivitySummariesMatchRebuild()
+
+        # Revise an activity's type and distance, move one to another month and repeat a key
+        upsert_activities(self.user, 'strava', [
+            activity('3', 9, 'Ride', distance=40.0),
+            activity('4', 70),
+            activity('5', 15, minutes=45),
+            activity('5', 15, minutes=50),
+        ])
+        self.assertActivitySummariesMatchRebuild()
+
+        # Emptying a month removes its summary
+        delete_activities(self.user, 'whoop', ['w1'])
+        delete_activities(self.user, 'strava', [str(n) for n in range(10, 20)])
+        self.assertFalse(ActivityMonthlySummary.objects.filter(source='whoop').exists())
+        self.assertActivitySummariesMatchRebuild()
+
+    def test_unchanged_revisions_leave_summaries_alone(self):
+        upsert_activities(self.user, 'strava', [activity('1', 0)])
+        before = summaries(ActivityMonthlySummary, self.activity_fields)
+
+        upsert_activities(self.user, 'strava', [dict(activity('1', 0), calories=200.0)])
+
+        self.assertEqual(before, summaries(ActivityMonthlySummary, self.activity_fields))
+
+    def test_metrics_summaries_count_each_measure_separately(self):
+        upsert_health_metrics(self.user, 'whoop', [
+            {'date': date(2024, 1, 1) + timedelta(days=n), 'resting_heart_rate': 50 + n % 5, 'hrv': 60.0 + n}
+            for n in range(45)
+        ])
+        # Recoveries and sleeps arrive separately and only for some days
+        upsert_health_metrics(self.user, 'whoop', [
+            {'date': date(2024, 1, 1) + timedelta(days=n), 'recovery_score': 70.0} for n in range(0, 45, 2)
+        ])
+        upsert_health_metrics(self.user, 'whoop', [
+            {'date': date(2024, 1, 1) + timedelta(days=n), 'sleep_duration': timedelta(hours=7)} for n in range(0, 45, 3)
+        ])
+        self.assertMetricsSummariesMatchRebuild()
+
+        upsert_health_metrics(self.user, 'whoop', [{'date': date(2024, 1, 5), 'hrv': 90.0, 'resting_heart_rate': 48}])
+        self.assertMetricsSummariesMatchRebuild()
+
+        january = HealthMetricsMonthlySummary.objects.get(month=date(2024, 1, 1))
+        self.assertEqual(january.days, 31)
+        self.assertEqual(january.recovery_score_count, 16)
+        self.assertEqual(january.sleep_duration_count, 11)
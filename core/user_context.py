@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
+from django.utils.functional import SimpleLazyObject, cached_property
+from integrations.models import UserIntegration
+from users.models import UserSettings
+from .models import ActivityMonthlySummary, HealthMetricsMonthlySummary
+
+class UserContext:
+    """
+    What views and templates need to know about the signed-in user, for one request.
+
+    Each part is loaded the first time it is used and kept for the rest of the request:
+    the user's settings (created for new users), all of their integrations in one query,
+    and whether they have any synced data.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def settings(self):
+        user_settings, created = UserSettings.objects.get_or_create(user=self.user)
+        return user_settings
+
+    @cached_property
+    def integrations(self):
+        """The user's integrations by provider"""
+        return {integration.provider: integration for integration in UserIntegration.objects.filter(user=self.user)}
+
+    def integration(self, provider):
+        """The user's integration with `provider`, or None if they have not connected it"""
+        return self.integrations.get(provider)
+
+    @cached_property
+    def has_data(self):
+        # The monthly summaries have a row for every month with data, so probing them is
+        # as good as probing the activities and metrics themselves
+        return get_user_model().objects.filter(pk=self.user.pk).filter(
+            Exists(ActivityMonthlySummary.objects.filter(user=OuterRef('pk')))
+            | Exists(HealthMetricsMonthlySummary.objects.filter(user=OuterRef('pk')))
+        ).exists()
+
+    @property
+    def distance_unit(self):
+        return self.settings.distance_unit
+
+    @property
+    def conversion_factor(self):
+        """Multiplier from the kilometres activities are stored in to the user's distance unit"""
+        return 0.621371 if self.settings.distance_unit == 'mi' else 1
+
+class UserContextMiddleware:
+    """Attach a UserContext for the signed-in user to every request as `request.user_context`"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Nothing is loaded, not even the user, until a view or template reads from it
+        request.user_context = SimpleLazyObject(lambda: UserContext(request.user))
+        return self.get_response(request)
+
+def user_context(request):
+    """Template context processor exposing the request's UserContext as `user_context`"""
+    return {'user_context': getattr(request, 'user_context', None)}
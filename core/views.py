@@ -2,11 +2,12 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db.models import Sum, Avg
-from django.db.models.functions import TruncMonth
 from django.utils import timezone
-from datetime import timedelta
-from .models import Activity, HealthMetrics
+from datetime import datetime, timedelta
+from .dashboard_cache import get_or_compute
+from .models import Activity, ActivityMonthlySummary, HealthMetrics, HealthMetricsMonthlySummary
 from integrations.models import UserIntegration
+from integrations.views import queued_sync_task
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,10 +32,7 @@ class LoginRedirectView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         try:
             # Check if user has any data
-            has_activities = Activity.objects.filter(user=request.user).exists()
-            has_metrics = HealthMetrics.objects.filter(user=request.user).exists()
-            
-            if not has_activities and not has_metrics:
+            if not request.user_context.has_data:
                 logger.info(f"User {request.user.username} has no data, redirecting to settings")
                 return redirect('settings')
             else:
@@ -45,91 +43,87 @@ class LoginRedirectView(LoginRequiredMixin, View):
             # Default to metrics page if there's an error
             return redirect('metrics')
 
-class ActivityListView(LoginRequiredMixin, ListView):
+class CachedMonthPagesMixin:
+    """
+    Cache each month page of a list view per user until the user's data next changes.
+
+    The view's queryset has one monthly summary per page and `get_month` turns a summary into
+    the (month, data) pair the template renders. A cache hit costs no database queries.
+    """
+    cache_name = None
+
+    def paginate_queryset(self, queryset, page_size):
+        page_number = self.request.GET.get(self.page_kwarg) or 1
+
+        def compute():
+            paginator, page, summaries, is_paginated = super(CachedMonthPagesMixin, self).paginate_queryset(queryset, page_size)
+            return {
+                'count': paginator.count,
+                'number': page.number,
+                'months': [self.get_month(summary) for summary in summaries],
+            }
+
+        cached = get_or_compute(self.request.user.id, f'{self.cache_name}:{page_number}', compute)
+        paginator = self.get_paginator(queryset, page_size)
+        paginator.count = cached['count']
+        page = paginator.page(cached['number'])
+        return (paginator, page, cached['months'], page.has_other_pages())
+
+class ActivityListView(LoginRequiredMixin, CachedMonthPagesMixin, ListView):
     model = Activity
     template_name = 'core/activity_list.html'
     context_object_name = 'months'
     paginate_by = 1
-
-    def dispatch(self, request, *args, **kwargs):
-        # Create UserSettings for new users before any other processing
-        # Only if the user is authenticated (should always be true due to LoginRequiredMixin)
-        if request.user.is_authenticated:
-            from users.models import UserSettings
-            UserSettings.objects.get_or_create(user=request.user)
-        return super().dispatch(request, *args, **kwargs)
+    cache_name = 'activities'
 
     def get_queryset(self):
-        try:
-            # Get all Strava activities grouped by month
-            activities = Activity.objects.filter(
-                user=self.request.user,
-                source='strava'  # Only show Strava activities
-            ).annotate(
-                month=TruncMonth('date')
-            ).order_by('-date')
+        # One row per month, kept up to date by the sync, so the page only ever loads the
+        # summary and activities of the month it shows
+        return ActivityMonthlySummary.objects.filter(
+            user=self.request.user,
+            source='strava'  # Only show Strava activities
+        ).order_by('-month')
 
-            # Group activities and calculate stats by month
-            months = {}
-            for activity in activities:
-                month_key = activity.month
-                if month_key not in months:
-                    months[month_key] = {
-                        'activities': [],
-                        'stats': {
-                            'total_activities': 0,
-                            'total_distance': 0,
-                            'total_duration': timedelta(),
-                            'activity_types': {}
-                        }
-                    }
-                
-                months[month_key]['activities'].append(activity)
-                
-                # Update month stats
-                months[month_key]['stats']['total_activities'] += 1
-                months[month_key]['stats']['total_distance'] += activity.distance or 0
-                months[month_key]['stats']['total_duration'] += activity.duration
-                
-                # Count activity types
-                activity_type = activity.activity_type
-                if activity_type not in months[month_key]['stats']['activity_types']:
-                    months[month_key]['stats']['activity_types'][activity_type] = 0
-                months[month_key]['stats']['activity_types'][activity_type] += 1
-            
-            # Sort activities by date
-            for month_data in months.values():
-                month_data['activities'].sort(key=lambda x: x.date, reverse=True)
-            
-            # Convert to list for pagination
-            return [(k, v) for k, v in sorted(months.items(), key=lambda x: x[0], reverse=True)]
-        except Exception as e:
-            # Log the error but return an empty list to avoid 500 errors
-            logger.error(f"Error in ActivityListView.get_queryset: {str(e)}")
-            return []
+    def get_month(self, summary):
+        """The (month, data) pair the template renders for one month's summary"""
+        month_start = timezone.make_aware(datetime.combine(summary.month, datetime.min.time()))
+        month_end = timezone.make_aware(datetime.combine((summary.month + timedelta(days=32)).replace(day=1), datetime.min.time()))
+        activities = Activity.objects.filter(
+            user=self.request.user,
+            source='strava',
+            date__gte=month_start,
+            date__lt=month_end
+        ).only(
+            'date', 'activity_type', 'duration', 'distance', 'average_heart_rate', 'average_cadence', 'source', 'external_id'
+        ).order_by('-date')
+        return (summary.month, {
+            'activities': list(activities),
+            'stats': {
+                'total_activities': summary.total_activities,
+                'total_distance': summary.total_distance,
+                'total_duration': summary.total_duration,
+                'activity_types': summary.activity_types
+            }
+        })
     
     def get_context_data(self, **kwargs):
         try:
             context = super().get_context_data(**kwargs)
             
-            # Get user settings
-            from users.models import UserSettings
-            user_settings = UserSettings.objects.get(user=self.request.user)
-            
-            # Add distance unit to context
-            context['distance_unit'] = user_settings.distance_unit
-            context['conversion_factor'] = 0.621371 if user_settings.distance_unit == 'mi' else 1
+            # Add distance unit to context (settings are created for new users on first use)
+            user_context = self.request.user_context
+            context['distance_unit'] = user_context.distance_unit
+            context['conversion_factor'] = user_context.conversion_factor
+            context['sync_task'] = queued_sync_task(self.request)
             
             # Check if user has Strava integration
-            from integrations.models import UserIntegration
-            try:
-                strava_integration = UserIntegration.objects.get(
-                    user=self.request.user,
-                    provider='strava'
-                )
+            from integrations.models import FullResyncJob
+            strava_integration = user_context.integration('strava')
+            if strava_integration:
                 context['strava_connected'] = True
                 context['last_sync'] = strava_integration.last_sync
-            except UserIntegration.DoesNotExist:
+                context['resync_job'] = FullResyncJob.objects.filter(user=self.request.user).first()
+            else:
                 context['strava_connected'] = False
                 context['last_sync'] = None
             
@@ -140,6 +134,7 @@ class ActivityListView(LoginRequiredMixin, ListView):
             
             # Create a minimal context that won't cause template errors
             context = super().get_context_data(**kwargs)
+            context['months'] = []
             context['distance_unit'] = 'mi'
             context['conversion_factor'] = 0.621371
             context['strava_connected'] = False
@@ -154,96 +149,57 @@ class ActivityDetailView(LoginRequiredMixin, DetailView):
     def get_queryset(self):
         return Activity.objects.filter(user=self.request.user)
 
-class MetricsListView(LoginRequiredMixin, ListView):
+class MetricsListView(LoginRequiredMixin, CachedMonthPagesMixin, ListView):
     model = HealthMetrics
     template_name = 'core/metrics_list.html'
     context_object_name = 'months'
     paginate_by = 1
-
-    def dispatch(self, request, *args, **kwargs):
-        # Create UserSettings for new users before any other processing
-        # Only if the user is authenticated (should always be true due to LoginRequiredMixin)
-        if request.user.is_authenticated:
-            from users.models import UserSettings
-            UserSettings.objects.get_or_create(user=request.user)
-        return super().dispatch(request, *args, **kwargs)
+    cache_name = 'metrics'
 
     def get_queryset(self):
-        try:
-            # Get all Whoop metrics grouped by month
-            metrics = HealthMetrics.objects.filter(
-                user=self.request.user,
-                source='whoop'  # Only show Whoop metrics
-            ).annotate(
-                month=TruncMonth('date')
-            ).order_by('-date')
-            
-            # Group metrics by month
-            months = {}
-            for metric in metrics:
-                month_key = metric.month
-                if month_key not in months:
-                    months[month_key] = {
-                        'metrics': [],
-                        'stats': {
-                            'avg_rhr': 0,
-                            'avg_hrv': 0,
-                            'avg_recovery': 0,
-                            'total_sleep': timedelta(),
-                        }
-                    }
-                
-                months[month_key]['metrics'].append(metric)
-            
-            # Calculate stats for each month
-            for month_key, month_data in months.items():
-                metrics_list = month_data['metrics']
-                
-                # Calculate averages
-                rhr_values = [m.resting_heart_rate for m in metrics_list if m.resting_heart_rate is not None]
-                hrv_values = [m.hrv for m in metrics_list if m.hrv is not None]
-                recovery_values = [m.recovery_score for m in metrics_list if m.recovery_score is not None]
-                
-                month_data['stats']['avg_rhr'] = sum(rhr_values) / len(rhr_values) if rhr_values else 0
-                month_data['stats']['avg_hrv'] = sum(hrv_values) / len(hrv_values) if hrv_values else 0
-                month_data['stats']['avg_recovery'] = sum(recovery_values) / len(recovery_values) if recovery_values else 0
-                
-                # Calculate total sleep
-                month_data['stats']['total_sleep'] = sum(
-                    (m.sleep_duration for m in metrics_list if m.sleep_duration is not None),
-                    timedelta()
-                )
-            
-            # Convert the dictionary to a list of tuples for pagination
-            months_list = [(k, v) for k, v in sorted(months.items(), key=lambda x: x[0], reverse=True)]
-            return months_list
-        except Exception as e:
-            # Log the error but return an empty list to avoid 500 errors
-            logger.error(f"Error in MetricsListView.get_queryset: {str(e)}")
-            return []
+        # One row per month, kept up to date by the sync, so the page only ever loads the
+        # summary and metrics of the month it shows
+        return HealthMetricsMonthlySummary.objects.filter(
+            user=self.request.user,
+            source='whoop'  # Only show Whoop metrics
+        ).order_by('-month')
+
+    def get_month(self, summary):
+        """The (month, data) pair the template renders for one month's summary"""
+        metrics = HealthMetrics.objects.filter(
+            user=self.request.user,
+            source='whoop',
+            date__gte=summary.month,
+            date__lt=(summary.month + timedelta(days=32)).replace(day=1)
+        ).only(
+            'date', 'hrv', 'recovery_score', 'resting_heart_rate', 'sleep_duration'
+        ).order_by('-date')
+        return (summary.month, {
+            'metrics': list(metrics),
+            'stats': {
+                'avg_rhr': summary.avg_rhr,
+                'avg_hrv': summary.avg_hrv,
+                'avg_recovery': summary.avg_recovery,
+                'total_sleep': summary.total_sleep,
+            }
+        })
     
     def get_context_data(self, **kwargs):
         try:
             context = super().get_context_data(**kwargs)
             
-            # Get user settings (should already be created in dispatch)
-            from users.models import UserSettings
-            user_settings = UserSettings.objects.get(user=self.request.user)
-            
-            # Add distance unit to context
-            context['distance_unit'] = user_settings.distance_unit
-            context['conversion_factor'] = 0.621371 if user_settings.distance_unit == 'mi' else 1
+            # Add distance unit to context (settings are created for new users on first use)
+            user_context = self.request.user_context
+            context['distance_unit'] = user_context.distance_unit
+            context['conversion_factor'] = user_context.conversion_factor
+            context['sync_task'] = queued_sync_task(self.request)
             
             # Check if user has Whoop integration
-            from integrations.models import UserIntegration
-            try:
-                whoop_integration = UserIntegration.objects.get(
-                    user=self.request.user,
-                    provider='whoop'
-                )
+            whoop_integration = user_context.integration('whoop')
+            if whoop_integration:
                 context['whoop_connected'] = True
                 context['last_sync'] = whoop_integration.last_sync
-            except UserIntegration.DoesNotExist:
+            else:
                 context['whoop_connected'] = False
                 context['last_sync'] = None
             
@@ -254,6 +210,7 @@ class MetricsListView(LoginRequiredMixin, ListView):
             
             # Create a minimal context that won't cause template errors
             context = super().get_context_data(**kwargs)
+            context['months'] = []
             context['distance_unit'] = 'mi'
             context['conversion_factor'] = 0.621371
             context['whoop_connected'] = False
@@ -110,13 +110,124 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+# Syncs a user asked for run on the interactive queue; the hourly sweep, webhooks and full
+# resyncs run on the bulk queue. Each queue has its own workers (see Procfile), so a sweep
+# never delays a sync someone is waiting for.
+CELERY_TASK_DEFAULT_QUEUE = 'bulk'
+CELERY_TASK_ROUTES = {
+    'integrations.tasks.*': {'queue': 'bulk'},
+}
+INTERACTIVE_SYNC_QUEUE = 'interactive'
+
+# The hourly sweep only dispatches integrations whose next_sync_at is due
+SYNC_SCHEDULE_CHUNK_SIZE = 500
+SYNC_SCHEDULE_TOLERANCE = 5 * 60  # Seconds
+
+# After each sync the next one is scheduled from the integration's history, between one and two
+# of the user's sync frequencies later. Within that window it is brought forward to
+# SYNC_UPLOAD_LAG_HOURS after any hour of the week in which new data started at least
+# SYNC_PATTERN_MIN_OCCURRENCES times in the last SYNC_PATTERN_DAYS days; otherwise it is at the
+# start of the window, or at its end after a sync that found nothing.
+SYNC_UPLOAD_LAG_HOURS = 2
+SYNC_PATTERN_DAYS = 8 * 7
+SYNC_PATTERN_MIN_OCCURRENCES = 2
+
 # Celery Beat Schedule
 CELERY_BEAT_SCHEDULE = {
     'sync-all-users': {
         'task': 'integrations.tasks.sync_all_users',
         'schedule': timedelta(hours=1),
     },
+    'refresh-expiring-tokens': {
+        'task': 'integrations.tasks.refresh_expiring_tokens',
+        'schedule': timedelta(minutes=10),
+    },
+    'rollup-sync-runs': {
+        'task': 'integrations.tasks.rollup_sync_runs',
+        'schedule': timedelta(days=1),
+    },
+}
+
+# Sync tasks record themselves in the SyncRun ledger rather than the result backend. Runs are
+# kept for SYNC_RUN_RETENTION_DAYS, their daily totals for SYNC_RUN_ROLLUP_RETENTION_DAYS.
+SYNC_RUN_RETENTION_DAYS = 14
+SYNC_RUN_ROLLUP_RETENTION_DAYS = 365
+
+# Strava API settings (the base URL can point at a local fake server for testing)
+STRAVA_API_BASE_URL = os.getenv('STRAVA_API_BASE_URL', 'https://www.strava.com/api/v3')
+STRAVA_DETAIL_CONCURRENCY = int(os.getenv('STRAVA_DETAIL_CONCURRENCY', '8'))
+# Activities whose details are fetched and written together. Kept well under Strava's 100
+# requests per 15 minutes so a batch fits in one window and a rate limit loses little work.
+STRAVA_DETAIL_BATCH_SIZE = int(os.getenv('STRAVA_DETAIL_BATCH_SIZE', '25'))
+
+# Redis used by the workers to share rate limits and coordinate syncs
+COORDINATION_REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Provider rate limits as (requests, window seconds), shortest window first. The buckets are shared
+# by every worker through Redis and corrected from the rate-limit headers of each response.
+PROVIDER_RATE_LIMITS = {
+    'strava': [(100, 15 * 60), (1000, 24 * 60 * 60)],
+    'whoop': [(100, 60), (10000, 24 * 60 * 60)],
+}
+RATE_LIMIT_MAX_WAIT = int(os.getenv('RATE_LIMIT_MAX_WAIT', '30'))  # Seconds a caller may block before rescheduling
+
+# Shared provider HTTP clients: one keep-alive connection pool per provider and process
+PROVIDER_HTTP_CONNECT_TIMEOUT = float(os.getenv('PROVIDER_HTTP_CONNECT_TIMEOUT', '5'))
+PROVIDER_HTTP_READ_TIMEOUT = float(os.getenv('PROVIDER_HTTP_READ_TIMEOUT', '30'))
+PROVIDER_HTTP_MAX_RETRIES = int(os.getenv('PROVIDER_HTTP_MAX_RETRIES', '3'))
+PROVIDER_HTTP_BACKOFF = float(os.getenv('PROVIDER_HTTP_BACKOFF', '0.5'))  # Base delay in seconds, doubled per retry
+
+# 'celery' fans the hourly sync out as one task per integration; 'asyncio' runs all of them
+# concurrently inside the beat task's worker process, capped per provider
+SYNC_DRIVER = os.getenv('SYNC_DRIVER', 'celery')
+SYNC_DRIVER_CONCURRENCY = {
+    'strava': int(os.getenv('SYNC_DRIVER_STRAVA_CONCURRENCY', '8')),
+    'whoop': int(os.getenv('SYNC_DRIVER_WHOOP_CONCURRENCY', '8')),
+}
+
+PROVIDER_HTTP_POOL_SIZE = max(10, STRAVA_DETAIL_CONCURRENCY, *SYNC_DRIVER_CONCURRENCY.values())
+
+# Whoop webhook events for a user within this many seconds are folded into one sync
+WHOOP_WEBHOOK_COALESCE_WINDOW = int(os.getenv('WHOOP_WEBHOOK_COALESCE_WINDOW', '60'))
+
+# Leases that keep syncs of the same integration from running at once. A sync's lease expires
+# after SYNC_LOCK_TTL seconds unless it is extended; interactive syncs wait up to SYNC_LOCK_WAIT
+# seconds for one already running. Token refreshes take their own shorter lease.
+SYNC_LOCK_TTL = 10 * 60
+SYNC_LOCK_WAIT = 30
+SYNC_LOCK_POLL_INTERVAL = 0.5
+TOKEN_REFRESH_LOCK_TTL = 60
+TOKEN_REFRESH_LOCK_WAIT = 30
+
+# Syncs refresh tokens expiring within TOKEN_REFRESH_BUFFER seconds. The token refresher runs
+# every 10 minutes and refreshes tokens expiring within TOKEN_REFRESH_AHEAD seconds, so syncs
+# rarely have to. Integrations whose refresh failed are retried after
+# TOKEN_REFRESH_RETRY_AFTER seconds.
+TOKEN_REFRESH_BUFFER = 5 * 60
+TOKEN_REFRESH_AHEAD = 30 * 60
+TOKEN_REFRESH_RETRY_AFTER = 30 * 60
+TOKEN_REFRESH_BATCH_SIZE = 100
+TOKEN_REFRESH_CONCURRENCY = 4
+
+# A full resync job that has not saved a page for this many seconds is assumed lost and is
+# resumed from its cursor the next time the user starts a full resync
+FULL_RESYNC_STALE_AFTER = 15 * 60
+
+# Rendered month pages are cached in Redis per user under a version that every write of the
+# user's data bumps, so entries never need deleting; stale versions expire after
+# DASHBOARD_CACHE_TIMEOUT seconds
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL', COORDINATION_REDIS_URL),
+        'KEY_PREFIX': 'health-manager',
+        'OPTIONS': {
+            'socket_connect_timeout': 2,
+            'socket_timeout': 2,
+        },
+    }
 }
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', str(24 * 60 * 60)))
 
 # Whoop settings
 SOCIAL_AUTH_WHOOP_KEY = os.getenv('WHOOP_CLIENT_ID')
@@ -214,6 +325,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware', # Required for admin
+    'core.user_context.UserContextMiddleware',  # Must come after AuthenticationMiddleware
     'django.contrib.messages.middleware.MessageMiddleware',    # Required for admin
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
@@ -246,6 +358,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'social_django.context_processors.backends',  # For social auth
                 'social_django.context_processors.login_redirect',  # For social auth
+                'core.user_context.user_context',
             ],
         },
     },
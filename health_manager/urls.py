@@ -7,9 +7,9 @@ from core.views import (
 )
 from users.views import RegisterView, settings, delete_user, CustomPasswordChangeView
 from integrations.views import (
-    sync_strava, sync_whoop, whoop_webhook, 
+    sync_strava, sync_whoop, sync_status, whoop_webhook, 
     connect_strava, complete_strava,
-    connect_whoop, full_resync_strava, direct_sync_strava, strava_debug
+    connect_whoop, full_resync_strava, full_resync_status, direct_sync_strava, strava_debug
 )
 
 urlpatterns = [
@@ -44,7 +44,9 @@ urlpatterns = [
     # Other URLs
     path('sync/strava/', sync_strava, name='sync_strava'),
     path('sync/strava/full/', full_resync_strava, name='full_resync_strava'),
+    path('sync/strava/full/status/', full_resync_status, name='full_resync_status'),
     path('sync/whoop/', sync_whoop, name='sync_whoop'),
+    path('sync/status/<str:task_id>/', sync_status, name='sync_status'),
     path('webhooks/whoop/', whoop_webhook, name='whoop_webhook'),
     path('sync/strava/direct/', direct_sync_strava, name='direct_sync_strava'),
     path('strava_debug/', strava_debug, name='strava_debug'),
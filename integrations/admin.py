@@ -1,8 +1,27 @@
 from django.contrib import admin
-from .models import UserIntegration
+from .models import FullResyncJob, SyncRun, SyncRunDaily, UserIntegration
 
 @admin.register(UserIntegration)
 class UserIntegrationAdmin(admin.ModelAdmin):
-    list_display = ('user', 'provider', 'last_sync', 'token_expires_at')
+    list_display = ('user', 'provider', 'last_sync', 'token_expires_at', 'token_refresh_failures')
     list_filter = ('provider',)
-    search_fields = ('user__username', 'external_id') 
\ No newline at end of file
+    search_fields = ('user__username', 'external_id') 
+
+@admin.register(FullResyncJob)
+class FullResyncJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'pages', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('user__username',)
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = ('integration', 'trigger', 'status', 'started_at', 'finished_at', 'api_calls', 'rows_created', 'rows_updated', 'webhook_events', 'error_class')
+    list_filter = ('status', 'trigger', 'integration__provider')
+    search_fields = ('integration__user__username', 'task_id')
+
+@admin.register(SyncRunDaily)
+class SyncRunDailyAdmin(admin.ModelAdmin):
+    list_display = ('integration', 'day', 'runs', 'failures', 'api_calls', 'bytes_downloaded', 'rows_created', 'rows_updated', 'webhook_events')
+    list_filter = ('integration__provider',)
+    search_fields = ('integration__user__username',)
+    date_hierarchy = 'day'
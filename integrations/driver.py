@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from .models import UserIntegration
+from .ledger import SyncRunRecorder
+from .locks import SyncInProgress
+from .ratelimit import RateLimitExceeded
+from .services.strava import StravaService
+from .services.whoop import WhoopService
+from .tasks import sync_strava_user, sync_whoop_user
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+SYNCS = {
+    'strava': (StravaService, 'sync_activities', sync_strava_user),
+    'whoop': (WhoopService, 'sync_data', sync_whoop_user),
+}
+
+def sync_integration(provider, user_id):
+    """Run one user's provider sync. Called on a driver thread."""
+    service_class, method, _ = SYNCS[provider]
+    try:
+        with SyncRunRecorder('scheduled') as run:
+            user = User.objects.get(id=user_id)
+            service = service_class(user)
+            run.integration = service.integration
+            run.finish(getattr(service, method)())
+    finally:
+        # Each driver thread has its own connection; don't leave it open after the job
+        connection.close()
+
+class AsyncSyncDriver:
+    """
+    Run many users' Strava and Whoop syncs concurrently in one worker process.
+
+    An asyncio event loop schedules the syncs and caps how many run at once per provider. The
+    provider services are blocking (HTTP and ORM writes), so each sync runs on a bounded thread
+    executor, where every thread gets its own database connection. Syncs that hit a provider's
+    rate limit are handed back to Celery to retry when the window has room.
+    """
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or settings.SYNC_DRIVER_CONCURRENCY
+
+    def run(self, jobs):
+        """Sync every (provider, user_id) in `jobs` and return counts of the outcomes"""
+        return asyncio.run(self._run(list(jobs)))
+
+    async def _run(self, jobs):
+        semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in self.concurrency.items()}
+        results = {'succeeded': 0, 'failed': 0, 'rescheduled': 0, 'skipped': 0}
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=sum(self.concurrency.values()), thread_name_prefix='sync-driver') as executor:
+            outcomes = await asyncio.gather(*(
+                self._run_one(loop, executor, semaphores[provider], provider, user_id)
+                for provider, user_id in jobs
+                if provider in semaphores
+            ))
+
+        for outcome in outcomes:
+            results[outcome] += 1
+        logger.info(f"Sync driver finished {len(outcomes)} syncs: {results}")
+        return results
+
+    async def _run_one(self, loop, executor, semaphore, provider, user_id):
+        async with semaphore:
+            try:
+                await loop.run_in_executor(executor, sync_integration, provider, user_id)
+                return 'succeeded'
+            except RateLimitExceeded as e:
+                logger.warning(f"{provider} rate limit reached for user ID {user_id}, rescheduling in {e.retry_after:.0f}s")
+                SYNCS[provider][2].apply_async((user_id,), countdown=e.retry_after)
+                return 'rescheduled'
+            except SyncInProgress:
+                logger.info(f"{provider} sync already running for user ID {user_id}, skipping")
+                return 'skipped'
+            except (User.DoesNotExist, UserIntegration.DoesNotExist):
+                logger.error(f"No {provider} integration found for user ID {user_id}")
+                return 'failed'
+            except Exception as e:
+                logger.error(f"Error syncing {provider} data for user ID {user_id}: {str(e)}")
+                return 'failed'
@@ -0,0 +1,157 @@
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from .ratelimit import get_governor
+
+logger = logging.getLogger(__name__)
+
+# Methods that are safe to send again after a server error or a dropped connection
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+class ProviderClient:
+    """
+    Shared HTTP client for one provider's API.
+
+    Keeps a pooled keep-alive session so calls reuse TLS connections, applies connect and read
+    timeouts to every request, and retries 429s and 5xx responses with exponential backoff and
+    jitter. Every attempt passes through the rate-limit governor. Latency is counted per
+    endpoint, with numeric ids folded out of the path.
+    """
+
+    def __init__(self, provider, pool_size=None, timeout=None, max_retries=None, backoff=None):
+        self.provider = provider
+        self.timeout = timeout or (settings.PROVIDER_HTTP_CONNECT_TIMEOUT, settings.PROVIDER_HTTP_READ_TIMEOUT)
+        self.max_retries = settings.PROVIDER_HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.PROVIDER_HTTP_BACKOFF if backoff is None else backoff
+
+        pool_size = pool_size or settings.PROVIDER_HTTP_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, max_wait=None, **kwargs):
+        """
+        Send a request, retrying transient failures.
+
+        Returns the last response once it succeeds or retries run out. Connection errors and
+        timeouts are raised after the last retry. Raises RateLimitExceeded if the governor
+        cannot allow the call within `max_wait` seconds.
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = self.endpoint_name(method, url)
+        governor = get_governor()
+
+        for attempt in range(self.max_retries + 1):
+            governor.acquire(self.provider, max_wait=max_wait)
+
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(endpoint, time.monotonic() - start, error=True)
+                if method not in IDEMPOTENT_METHODS or attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"{endpoint} failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self.record(endpoint, time.monotonic() - start, error=response.status_code >= 400, size=len(response.content))
+            governor.observe(self.provider, response)
+
+            retryable = response.status_code == 429 or (response.status_code >= 500 and method in IDEMPOTENT_METHODS)
+            if not retryable or attempt == self.max_retries:
+                return response
+
+            # A 429 also blocks the provider in the governor, so the next acquire waits it out
+            delay = self.backoff_delay(attempt)
+            logger.warning(f"{endpoint} returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    @staticmethod
+    def endpoint_name(method, url):
+        path = re.sub(r'/\d+(?=/|$)', '/{id}', urlsplit(url).path)
+        return f"{method} {path}"
+
+    def record(self, endpoint, elapsed, error=False, size=0):
+        meter = _meter.get()
+        if meter is not None:
+            meter.add(size)
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {'calls': 0, 'errors': 0, 'bytes': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['bytes'] += size
+            stats['total_ms'] += elapsed * 1000
+            stats['max_ms'] = max(stats['max_ms'], elapsed * 1000)
+
+    def stats(self):
+        """Per-endpoint call, error and latency counters since the process started"""
+        with self._stats_lock:
+            return {
+                endpoint: dict(stats, avg_ms=stats['total_ms'] / stats['calls'])
+                for endpoint, stats in self._stats.items()
+            }
+
+class CallMeter:
+    """Provider calls and bytes downloaded by one sync, across all the threads it uses"""
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.calls += 1
+            self.bytes += size
+
+_meter = contextvars.ContextVar('provider_call_meter', default=None)
+
+@contextmanager
+def metered():
+    """Count the provider calls made inside the block, including on threads started with carry_context"""
+    meter = CallMeter()
+    token = _meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _meter.reset(token)
+
+def carry_context(func):
+    """Wrap `func` to run in a copy of the caller's context, so executor threads keep its meter"""
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(func, *args)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(provider):
+    """Get the process-wide client for `provider`, created on first use so forked workers get their own"""
+    with _clients_lock:
+        if provider not in _clients:
+            _clients[provider] = ProviderClient(provider)
+        return _clients[provider]
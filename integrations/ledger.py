@@ -0,0 +1,151 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .http_client import metered
+from .locks import SyncInProgress
+from .models import SyncRun, SyncRunDaily
+from .ratelimit import RateLimitExceeded
+from .scheduler import schedule_next_sync
+
+logger = logging.getLogger(__name__)
+
+def count_rows(result):
+    """Total the created and updated counts anywhere in a service's sync result"""
+    created = updated = 0
+    for key, value in (result or {}).items():
+        if isinstance(value, dict):
+            nested_created, nested_updated = count_rows(value)
+            created += nested_created
+            updated += nested_updated
+        elif key == 'created':
+            created += value
+        elif key == 'updated':
+            updated += value
+    return created, updated
+
+class SyncRunRecorder:
+    """
+    Record one sync in the SyncRun ledger.
+
+    Used as a context manager around the sync. Provider calls and bytes are counted while the
+    block runs; set `integration` once the service is built, `webhook_events` to the number of
+    webhook events the sync absorbed, and pass the service's result to `finish`. A single row
+    is inserted when the block exits, whether it succeeded or not, and a successful sync
+    schedules the integration's next one. Exceptions are never swallowed.
+    """
+
+    def __init__(self, trigger, task_id=None):
+        self.trigger = trigger
+        self.task_id = task_id
+        self.integration = None
+        self.webhook_events = 0
+        self.result = None
+
+    def __enter__(self):
+        self.started_at = timezone.now()
+        self._metered = metered()
+        self.meter = self._metered.__enter__()
+        return self
+
+    def finish(self, result):
+        self.result = result
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metered.__exit__(exc_type, exc, tb)
+        if self.integration is None:
+            return False
+
+        if exc_type is None:
+            status = 'succeeded'
+        elif issubclass(exc_type, SyncInProgress):
+            status = 'skipped'
+        elif issubclass(exc_type, RateLimitExceeded):
+            status = 'rate_limited'
+        else:
+            status = 'failed'
+        created, updated = count_rows(self.result)
+
+        try:
+            SyncRun.objects.create(
+                integration=self.integration,
+                task_id=self.task_id,
+                trigger=self.trigger,
+                status=status,
+                started_at=self.started_at,
+                finished_at=timezone.now(),
+                api_calls=self.meter.calls,
+                bytes_downloaded=self.meter.bytes,
+                rows_created=created,
+                rows_updated=updated,
+                webhook_events=self.webhook_events,
+                error_class=exc_type.__name__ if exc_type and status == 'failed' else '',
+            )
+        except Exception as e:
+            # The ledger is for observability; never fail a sync because it could not be written
+            logger.error(f"Could not record sync run for integration {self.integration.id}: {str(e)}")
+
+        if status == 'succeeded':
+            try:
+                schedule_next_sync(self.integration, found_data=created + updated > 0)
+            except Exception as e:
+                # The sweep already pushed next_sync_at out by the user's sync frequency
+                logger.error(f"Could not schedule next sync for integration {self.integration.id}: {str(e)}")
+        return False
+
+def rollup_sync_runs(now=None):
+    """
+    Fold the retained SyncRuns into daily totals and prune runs past their retention.
+
+    Every complete day whose runs are all still retained is recomputed, so running this more
+    than once a day, or after a missed day, gives the same totals.
+    """
+    now = now or timezone.now()
+    today = now.date()
+    cutoff = now - timedelta(days=settings.SYNC_RUN_RETENTION_DAYS)
+    # The day the cutoff falls on has already lost some runs, so start from the day after it
+    first_day = cutoff.date() + timedelta(days=1)
+
+    days = (
+        SyncRun.objects.filter(started_at__date__gte=first_day, started_at__date__lt=today)
+        .annotate(day=TruncDate('started_at'))
+        .values('integration_id', 'day')
+        .annotate(
+            runs=Count('id'),
+            failures=Count('id', filter=Q(status='failed')),
+            api_calls=Sum('api_calls'),
+            bytes_downloaded=Sum('bytes_downloaded'),
+            rows_created=Sum('rows_created'),
+            rows_updated=Sum('rows_updated'),
+            webhook_events=Sum('webhook_events'),
+            sync_seconds=Sum(F('finished_at') - F('started_at')),
+        )
+    )
+    rollups = [
+        SyncRunDaily(
+            integration_id=day['integration_id'],
+            day=day['day'],
+            runs=day['runs'],
+            failures=day['failures'],
+            api_calls=day['api_calls'],
+            bytes_downloaded=day['bytes_downloaded'],
+            rows_created=day['rows_created'],
+            rows_updated=day['rows_updated'],
+            webhook_events=day['webhook_events'],
+            sync_seconds=day['sync_seconds'].total_seconds() if day['sync_seconds'] else 0,
+        )
+        for day in days
+    ]
+    SyncRunDaily.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=['integration', 'day'],
+        update_fields=['runs', 'failures', 'api_calls', 'bytes_downloaded', 'rows_created', 'rows_updated', 'webhook_events', 'sync_seconds'],
+    )
+
+    pruned, _ = SyncRun.objects.filter(started_at__lt=cutoff).delete()
+    expired, _ = SyncRunDaily.objects.filter(day__lt=today - timedelta(days=settings.SYNC_RUN_ROLLUP_RETENTION_DAYS)).delete()
+    logger.info(f"Rolled up sync runs into {len(rollups)} daily totals, pruned {pruned} runs and {expired} old daily totals")
+    return {'days': len(rollups), 'pruned': pruned}
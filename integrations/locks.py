@@ -0,0 +1,156 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+import redis
+from django.conf import settings
+from django.utils import timezone
+from .redis_store import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Deletes or extends a lease only if it is still held by the caller's token, so a worker whose
+# lease expired cannot release or extend the next holder's lease
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+class SyncInProgress(Exception):
+    """Raised when another worker holds the lease on an integration"""
+
+    def __init__(self, integration_id, name):
+        self.integration_id = integration_id
+        self.name = name
+        super().__init__(f"The {name} lease on integration {integration_id} is held by another worker")
+
+class IntegrationLease:
+    """
+    A Redis lease on one UserIntegration, held by at most one worker at a time.
+
+    The lease expires after `ttl` seconds unless extended, so a crashed worker cannot hold an
+    integration forever. If Redis is unavailable the lease is treated as acquired, like the
+    rate-limit governor, so syncs keep running without coordination.
+    """
+
+    def __init__(self, integration_id, name='sync', ttl=None):
+        self.integration_id = integration_id
+        self.name = name
+        self.ttl = ttl or settings.SYNC_LOCK_TTL
+        self.key = f"lease:{name}:{integration_id}"
+        self.token = uuid.uuid4().hex
+        self.held = False
+
+    def acquire(self, wait=0):
+        """Take the lease, waiting up to `wait` seconds for the current holder. Returns whether it was taken."""
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                if get_redis().set(self.key, self.token, nx=True, px=int(self.ttl * 1000)):
+                    self.held = True
+                    return True
+            except redis.RedisError as e:
+                logger.warning(f"Could not take {self.name} lease for integration {self.integration_id}, continuing without it: {str(e)}")
+                self.held = True
+                return True
+
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(settings.SYNC_LOCK_POLL_INTERVAL)
+
+    def extend(self):
+        """Push the lease's expiry `ttl` seconds out again, e.g. after each page of a long sync"""
+        if not self.held:
+            return
+        try:
+            get_redis().eval(EXTEND_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000))
+        except redis.RedisError as e:
+            logger.warning(f"Could not extend {self.name} lease for integration {self.integration_id}: {str(e)}")
+
+    def release(self):
+        if not self.held:
+            return
+        self.held = False
+        try:
+            get_redis().eval(RELEASE_SCRIPT, 1, self.key, self.token)
+        except redis.RedisError as e:
+            logger.warning(f"Could not release {self.name} lease for integration {self.integration_id}: {str(e)}")
+
+    @contextmanager
+    def hold(self, wait=0):
+        """Hold the lease for the duration of the block, raising SyncInProgress if it is taken"""
+        if not self.acquire(wait):
+            raise SyncInProgress(self.integration_id, self.name)
+        try:
+            yield self
+        finally:
+            self.release()
+
+def holds_sync_lease(method):
+    """
+    Run a service sync method while holding its integration's sync lease.
+
+    Accepts a `lock_wait` keyword for how long to wait for a sync that is already running,
+    0 by default. The integration is reloaded once the lease is taken so the sync starts from
+    whatever the previous holder saved. Nested calls reuse the lease already held.
+    """
+    @wraps(method)
+    def wrapper(self, *args, lock_wait=0, **kwargs):
+        if getattr(self, 'lease', None) is not None:
+            return method(self, *args, **kwargs)
+
+        self.lease = IntegrationLease(self.integration.id)
+        try:
+            with self.lease.hold(wait=lock_wait):
+                self.integration.refresh_from_db()
+                return method(self, *args, **kwargs)
+        finally:
+            self.lease = None
+    return wrapper
+
+class TokenRefreshMixin:
+    """
+    Single-flight access token refresh for a provider service.
+
+    The service sets `integration` and implements `refresh_token()`, which exchanges the refresh
+    token and saves the new tokens on the integration.
+    """
+
+    def refresh_token_if_needed(self, within=None, tolerate_failure=True):
+        """
+        Refresh the access token if it expires within `within` (TOKEN_REFRESH_BUFFER by default),
+        once across all workers.
+
+        The token refresher task normally gets there first. If a refresh fails while the current
+        token is still valid, the sync carries on with it unless `tolerate_failure` is False.
+        """
+        if not self.token_expiring(within):
+            return
+        # Refreshing invalidates the old refresh token, so only one worker may refresh at a time;
+        # the others wait for it and pick up the new tokens
+        with IntegrationLease(self.integration.id, 'token-refresh', ttl=settings.TOKEN_REFRESH_LOCK_TTL).hold(wait=settings.TOKEN_REFRESH_LOCK_WAIT):
+            self.integration.refresh_from_db()
+            if not self.token_expiring(within):
+                return
+            try:
+                self.refresh_token()
+            except Exception as e:
+                if not tolerate_failure or self.token_expiring(timedelta(0)):
+                    raise
+                logger.warning(f"{self.integration.provider} token refresh failed, using the current token until it expires: {str(e)}")
+
+    def token_expiring(self, within=None):
+        if within is None:
+            within = timedelta(seconds=settings.TOKEN_REFRESH_BUFFER)
+        return self.integration.token_expires_at <= timezone.now() + within
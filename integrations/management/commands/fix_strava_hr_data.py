@@ -1,8 +1,7 @@
 import logging
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from datetime import datetime, timedelta
-import requests
+from core.dashboard_cache import bump_version
 from core.models import Activity
 from integrations.models import UserIntegration
 from integrations.services.strava import StravaService
@@ -12,6 +11,10 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Fix heart rate and cadence data for existing Strava activities'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of activities to fetch details for at a time')
+        parser.add_argument('--concurrency', type=int, help='Number of activity details to fetch at once, defaults to STRAVA_DETAIL_CONCURRENCY')
+
     def handle(self, *args, **options):
         self.stdout.write('Starting to fix heart rate and cadence data for existing Strava activities')
         
@@ -27,39 +30,38 @@ class Command(BaseCommand):
             
             try:
                 # Create Strava service
-                service = StravaService(user)
+                service = StravaService(user, detail_concurrency=options.get('concurrency'))
                 
                 # Refresh token if needed
                 service.refresh_token_if_needed()
                 
                 # Get activities without heart rate or cadence
-                activities = Activity.objects.filter(
+                activities = list(Activity.objects.filter(
                     user=user,
                     source='strava',
                     average_heart_rate__isnull=True
-                )
+                ))
                 
                 self.stdout.write(f'Found {len(activities)} activities without heart rate data')
                 
-                headers = {
-                    'Authorization': f'Bearer {integration.access_token}'
-                }
+                # Fetch details concurrently, one batch at a time, reusing the sync's fetcher
+                fetcher = service.detail_fetcher()
+                batch_size = options['batch_size']
                 
                 fixed_count = 0
                 
-                for activity in activities:
-                    try:
+                for offset in range(0, len(activities), batch_size):
+                    batch = activities[offset:offset + batch_size]
+                    self.stdout.write(f'Fetching details for activities {offset + 1}-{offset + len(batch)}')
+                    details = fetcher.fetch([activity.external_id for activity in batch])
+                    fixed_before = fixed_count
+                    
+                    for activity, detailed_data in zip(batch, details):
                         activity_id = activity.external_id
-                        self.stdout.write(f'Fixing data for activity: {activity_id}')
-                        
-                        # Get detailed activity data
-                        detailed_url = f"{service.BASE_URL}/activities/{activity_id}"
-                        self.stdout.write(f'Making request to {detailed_url}')
-                        
-                        detailed_response = requests.get(detailed_url, headers=headers)
-                        
-                        if detailed_response.status_code == 200:
-                            detailed_data = detailed_response.json()
+                        try:
+                            if not detailed_data:
+                                self.stdout.write(self.style.ERROR(f'Failed to get detailed data for activity {activity_id}'))
+                                continue
                             
                             # Extract heart rate - check for 'average_heartrate' (Strava API format)
                             heart_rate = None
@@ -89,11 +91,13 @@ class Command(BaseCommand):
                                 self.stdout.write(f'Updated activity {activity_id}')
                             else:
                                 self.stdout.write(f'No heart rate or cadence data found for activity {activity_id}')
-                        else:
-                            self.stdout.write(self.style.ERROR(f'Failed to get detailed data for activity {activity_id}. Status: {detailed_response.status_code}'))
+                        
+                        except Exception as e:
+                            self.stdout.write(self.style.ERROR(f'Error processing activity {activity_id}: {str(e)}'))
                     
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f'Error processing activity {activity.external_id}: {str(e)}'))
+                    # These saves bypass core.ingest, so drop the user's cached pages here
+                    if fixed_count > fixed_before:
+                        bump_version(user.id)
                 
                 self.stdout.write(self.style.SUCCESS(f'Fixed {fixed_count} activities for user {user.username}'))
                 total_fixed += fixed_count
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from integrations.driver import AsyncSyncDriver
+from integrations.models import UserIntegration
+import time
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = 'Sync many users concurrently from this process with the asyncio sync driver'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', choices=['strava', 'whoop'], help='Provider to sync, defaults to both')
+        parser.add_argument('--user', type=str, help='Username to sync, defaults to all users')
+        parser.add_argument('--strava-concurrency', type=int, help='Maximum concurrent Strava syncs')
+        parser.add_argument('--whoop-concurrency', type=int, help='Maximum concurrent Whoop syncs')
+
+    def handle(self, *args, **options):
+        integrations = UserIntegration.objects.filter(provider__in=['strava', 'whoop'])
+        if options['provider']:
+            integrations = integrations.filter(provider=options['provider'])
+        if options['user']:
+            integrations = integrations.filter(user__username=options['user'])
+
+        jobs = list(integrations.values_list('provider', 'user_id'))
+        self.stdout.write(f'Syncing {len(jobs)} integration(s)')
+
+        driver = AsyncSyncDriver()
+        if options['strava_concurrency']:
+            driver.concurrency = dict(driver.concurrency, strava=options['strava_concurrency'])
+        if options['whoop_concurrency']:
+            driver.concurrency = dict(driver.concurrency, whoop=options['whoop_concurrency'])
+
+        start_time = time.time()
+        results = driver.run(jobs)
+        self.stdout.write(f'Sync took {time.time() - start_time:.2f} seconds')
+        self.stdout.write(self.style.SUCCESS(
+            f"{results['succeeded']} succeeded, {results['failed']} failed, {results['rescheduled']} rescheduled"
+        ))
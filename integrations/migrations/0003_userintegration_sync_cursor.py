@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0002_userintegration_external_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userintegration',
+            name='sync_cursor',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
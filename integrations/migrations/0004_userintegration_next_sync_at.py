@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0003_userintegration_sync_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userintegration',
+            name='next_sync_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0005_fullresyncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('trigger', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('succeeded', 'Succeeded'), ('failed', 'Failed'), ('skipped', 'Skipped'), ('rate_limited', 'Rate limited')], max_length=20)),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('finished_at', models.DateTimeField()),
+                ('api_calls', models.IntegerField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('rows_created', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('error_class', models.CharField(blank=True, max_length=100)),
+                ('integration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='integrations.userintegration')),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncRunDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('runs', models.IntegerField(default=0)),
+                ('failures', models.IntegerField(default=0)),
+                ('api_calls', models.IntegerField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('rows_created', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('sync_seconds', models.FloatField(default=0)),
+                ('integration', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_run_days', to='integrations.userintegration')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'unique_together': {('integration', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0006_syncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userintegration',
+            name='token_refresh_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='userintegration',
+            name='token_refresh_failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userintegration',
+            name='token_refresh_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='userintegration',
+            name='token_expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
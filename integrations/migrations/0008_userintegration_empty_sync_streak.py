@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0007_token_refresh_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userintegration',
+            name='empty_sync_streak',
+            field=models.IntegerField(default=0),
+        ),
+    ]
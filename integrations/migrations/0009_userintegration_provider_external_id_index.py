@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0008_userintegration_empty_sync_streak'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userintegration',
+            index=models.Index(fields=['provider', 'external_id'], name='integration_provider_ext_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0009_userintegration_provider_external_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fullresyncjob',
+            name='chain_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
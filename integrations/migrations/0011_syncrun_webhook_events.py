@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('integrations', '0010_fullresyncjob_chain_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='webhook_events',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='syncrundaily',
+            name='webhook_events',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -6,9 +6,89 @@ class UserIntegration(models.Model):
     provider = models.CharField(max_length=20)  # 'strava' or 'whoop'
     access_token = models.CharField(max_length=255)
     refresh_token = models.CharField(max_length=255)
-    token_expires_at = models.DateTimeField()
+    token_expires_at = models.DateTimeField(db_index=True)
     last_sync = models.DateTimeField(null=True, blank=True)
+    sync_cursor = models.DateTimeField(null=True, blank=True)  # Newest activity stored by an unfinished sync
+    next_sync_at = models.DateTimeField(null=True, blank=True, db_index=True)  # When the scheduled sync is next due
+    empty_sync_streak = models.IntegerField(default=0)  # Consecutive syncs that found no new or changed data
     external_id = models.CharField(max_length=100, null=True, blank=True)  # For storing provider-specific user IDs
+    token_refresh_failures = models.IntegerField(default=0)  # Consecutive failed refreshes by the token refresher
+    token_refresh_error = models.TextField(blank=True)
+    token_refresh_failed_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
-        unique_together = ('user', 'provider') 
\ No newline at end of file
+        unique_together = ('user', 'provider')
+        indexes = [
+            # Webhooks find the integration from the provider's user id
+            models.Index(fields=['provider', 'external_id'], name='integration_provider_ext_idx'),
+        ]
+
+class FullResyncJob(models.Model):
+    """A full Strava resync run as a chain of one-page Celery tasks, resumable from its cursor"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    cursor = models.BigIntegerField(default=0)  # Epoch seconds the next page starts after
+    boundary_ids = models.JSONField(default=list)  # Activities at the cursor's second already processed
+    pages = models.IntegerField(default=0)
+    counts = models.JSONField(default=dict)  # Running totals from process_activity_page
+    error = models.TextField(blank=True)
+    chain_id = models.CharField(max_length=32, blank=True)  # The task chain allowed to work on the job
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    @property
+    def active(self):
+        return self.status in ('pending', 'running')
+
+class SyncRun(models.Model):
+    """One sync of an integration, written once when the sync ends"""
+    STATUS_CHOICES = [
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),  # Another sync of the integration was running
+        ('rate_limited', 'Rate limited'),  # Retried once the provider's window has room
+    ]
+
+    integration = models.ForeignKey(UserIntegration, on_delete=models.CASCADE, related_name='sync_runs')
+    task_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    trigger = models.CharField(max_length=20)  # 'scheduled', 'interactive' or 'webhook'
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    started_at = models.DateTimeField(db_index=True)
+    finished_at = models.DateTimeField()
+    api_calls = models.IntegerField(default=0)
+    bytes_downloaded = models.BigIntegerField(default=0)
+    rows_created = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    webhook_events = models.IntegerField(default=0)  # Webhook events the sync absorbed
+    error_class = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+
+class SyncRunDaily(models.Model):
+    """SyncRun totals per integration and day, kept after the runs themselves are pruned"""
+    integration = models.ForeignKey(UserIntegration, on_delete=models.CASCADE, related_name='sync_run_days')
+    day = models.DateField()
+    runs = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    api_calls = models.IntegerField(default=0)
+    bytes_downloaded = models.BigIntegerField(default=0)
+    rows_created = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    webhook_events = models.IntegerField(default=0)
+    sync_seconds = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('integration', 'day')
+        ordering = ['-day']
@@ -2,6 +2,7 @@ from social_core.backends.oauth import BaseOAuth2
 import logging
 from urllib.parse import urljoin
 from django.conf import settings
+from .http_client import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +41,12 @@ class WhoopOAuth2(BaseOAuth2):
         logger.info(f"Auth complete params redirect_uri: {params['redirect_uri']}")
         return params
     
+    def request(self, url, method='GET', *args, **kwargs):
+        """Send OAuth and profile requests through the shared Whoop client"""
+        response = get_client('whoop').request(method, url, *args, **kwargs)
+        response.raise_for_status()
+        return response
+    
     def get_user_details(self, response):
         """Return user details from Whoop account"""
         return {
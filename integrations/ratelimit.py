@@ -0,0 +1,172 @@
+import logging
+import time
+import redis
+from django.conf import settings
+from .redis_store import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Takes one token from every bucket of a provider, or none if any bucket is empty.
+# Buckets refill continuously at capacity / window tokens per second. Returns the number
+# of milliseconds to wait before a token is available, 0 if one was taken.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local blocked = redis.call('PTTL', KEYS[1])
+if blocked > 0 then
+    return blocked
+end
+
+local wait = 0
+local state = {}
+for i = 2, #KEYS do
+    local capacity = tonumber(ARGV[i * 2 - 2])
+    local window = tonumber(ARGV[i * 2 - 1])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts', 'capacity')
+    capacity = tonumber(bucket[3]) or capacity
+    local rate = capacity / window
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+    if tokens < 1 then
+        wait = math.max(wait, math.ceil((1 - tokens) / rate * 1000))
+    end
+    state[i] = {tokens, capacity, window}
+end
+
+if wait > 0 then
+    return wait
+end
+
+for i = 2, #KEYS do
+    redis.call('HSET', KEYS[i], 'tokens', state[i][1] - 1, 'ts', now, 'capacity', state[i][2])
+    redis.call('PEXPIRE', KEYS[i], state[i][3] * 2000)
+end
+return 0
+"""
+
+class RateLimitExceeded(Exception):
+    """Raised when a provider call cannot be made within the allowed wait"""
+
+    def __init__(self, provider, retry_after):
+        self.provider = provider
+        self.retry_after = retry_after
+        super().__init__(f"{provider} rate limit reached, retry in {retry_after:.0f}s")
+
+class RateLimitGovernor:
+    """
+    Cluster-wide token buckets for provider API calls, shared through Redis.
+
+    Each provider has one bucket per rate-limit window (e.g. Strava's 15 minute and daily
+    limits), keyed by provider and OAuth application so every worker draws from the same
+    budget. Responses feed the provider's reported usage back into the buckets, and a 429
+    or an exhausted window blocks the provider until the window resets.
+    """
+
+    def __init__(self, redis_client, limits=None):
+        self.redis = redis_client
+        self.limits = limits or settings.PROVIDER_RATE_LIMITS
+        self.acquire_script = self.redis.register_script(ACQUIRE_SCRIPT)
+
+    def key_prefix(self, provider):
+        app_ids = {
+            'strava': settings.SOCIAL_AUTH_STRAVA_KEY,
+            'whoop': settings.SOCIAL_AUTH_WHOOP_KEY,
+        }
+        return f"ratelimit:{provider}:{app_ids.get(provider) or 'default'}"
+
+    def bucket_keys(self, provider):
+        prefix = self.key_prefix(provider)
+        return [f"{prefix}:blocked"] + [f"{prefix}:{window}" for _, window in self.limits[provider]]
+
+    def acquire(self, provider, max_wait=None):
+        """
+        Take a token for one call to `provider`, sleeping while the buckets refill.
+
+        Raises RateLimitExceeded if the call could not be made within `max_wait` seconds.
+        """
+        if provider not in self.limits:
+            return
+
+        max_wait = settings.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        waited = 0
+        args = []
+        for capacity, window in self.limits[provider]:
+            args.extend([capacity, window])
+
+        while True:
+            try:
+                wait = self.acquire_script(keys=self.bucket_keys(provider), args=[int(time.time() * 1000)] + args) / 1000
+            except redis.RedisError as e:
+                # Never let the governor itself take the integrations down
+                logger.warning(f"Rate limit governor unavailable, allowing {provider} call: {str(e)}")
+                return
+
+            if wait <= 0:
+                return
+
+            if waited + wait > max_wait:
+                raise RateLimitExceeded(provider, wait)
+
+            logger.info(f"Waiting {wait:.1f}s for {provider} rate limit")
+            time.sleep(wait)
+            waited += wait
+
+    def observe(self, provider, response):
+        """Correct the provider's buckets from the rate-limit headers of `response`"""
+        if provider not in self.limits:
+            return
+
+        try:
+            self._observe(provider, response)
+        except redis.RedisError as e:
+            logger.warning(f"Rate limit governor unavailable, ignoring {provider} headers: {str(e)}")
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Could not parse {provider} rate limit headers: {str(e)}")
+
+    def _observe(self, provider, response):
+        headers = response.headers
+        prefix = self.key_prefix(provider)
+        now = time.time()
+
+        if response.status_code == 429:
+            retry_after = headers.get('Retry-After')
+            block_for = float(retry_after) if retry_after else self.seconds_until_reset(self.limits[provider][0][1], now)
+            logger.warning(f"{provider} returned 429, blocking calls for {block_for:.0f}s")
+            self.block(provider, block_for)
+            return
+
+        # Strava reports comma separated limits and usage for each window, shortest first
+        if 'X-RateLimit-Limit' in headers and 'X-RateLimit-Usage' in headers:
+            limits = [int(v) for v in headers['X-RateLimit-Limit'].split(',')]
+            usages = [int(v) for v in headers['X-RateLimit-Usage'].split(',')]
+            pipe = self.redis.pipeline()
+            for (_, window), limit, usage in zip(self.limits[provider], limits, usages):
+                remaining = max(0, limit - usage)
+                pipe.hset(f"{prefix}:{window}", mapping={'tokens': remaining, 'ts': int(now * 1000), 'capacity': limit})
+                pipe.pexpire(f"{prefix}:{window}", window * 2000)
+                if remaining == 0:
+                    self.block(provider, self.seconds_until_reset(window, now))
+            pipe.execute()
+
+        # Whoop reports the remaining calls and seconds until the current window resets
+        elif headers.get('X-RateLimit-Remaining') is not None and headers.get('X-RateLimit-Reset') is not None:
+            if int(headers['X-RateLimit-Remaining']) <= 0:
+                self.block(provider, float(headers['X-RateLimit-Reset']))
+
+    def block(self, provider, seconds):
+        """Stop all calls to `provider` for `seconds`"""
+        self.redis.set(f"{self.key_prefix(provider)}:blocked", 1, px=max(1, int(seconds * 1000)))
+
+    @staticmethod
+    def seconds_until_reset(window, now):
+        """Provider windows reset on fixed boundaries (quarter hours, midnight UTC)"""
+        return window - (now % window)
+
+_governor = None
+
+def get_governor():
+    """Get the process-wide governor, connecting to Redis on first use"""
+    global _governor
+    if _governor is None:
+        _governor = RateLimitGovernor(get_redis())
+    return _governor
@@ -0,0 +1,11 @@
+import redis
+from django.conf import settings
+
+_redis = None
+
+def get_redis():
+    """Get the process-wide Redis connection used for cross-worker coordination"""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.COORDINATION_REDIS_URL, socket_connect_timeout=2, socket_timeout=2)
+    return _redis
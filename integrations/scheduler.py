@@ -0,0 +1,134 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+from core.models import Activity, HealthMetrics
+from users.models import UserSettings
+from .models import UserIntegration
+
+logger = logging.getLogger(__name__)
+
+SYNC_PROVIDERS = ['strava', 'whoop']
+DEFAULT_SYNC_FREQUENCY = 24  # Hours, matches the UserSettings default
+
+def iter_due_integrations(now=None, chunk_size=None):
+    """
+    Yield chunks of (provider, user_id) for integrations whose next sync is due.
+
+    Integrations are read as plain tuples in id order, one chunk at a time. Each chunk's
+    next_sync_at is moved forward by its user's sync frequency before it is yielded, so an
+    integration is dispatched at most once per period even if its sync is still running when
+    the next sweep starts. A successful sync then replaces it with an adaptive time from
+    schedule_next_sync.
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or settings.SYNC_SCHEDULE_CHUNK_SIZE
+    # Beat does not fire at exactly the same second every hour; treat anything due before the
+    # next sweep could pick it up as due now
+    due_before = now + timedelta(seconds=settings.SYNC_SCHEDULE_TOLERANCE)
+
+    due = UserIntegration.objects.filter(
+        Q(next_sync_at__isnull=True) | Q(next_sync_at__lte=due_before),
+        provider__in=SYNC_PROVIDERS
+    ).order_by('id')
+
+    last_id = 0
+    while True:
+        chunk = list(
+            due.filter(id__gt=last_id).values_list('id', 'provider', 'user_id', 'user__usersettings__sync_frequency')[:chunk_size]
+        )
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+
+        by_frequency = {}
+        for integration_id, _, _, frequency in chunk:
+            by_frequency.setdefault(frequency or DEFAULT_SYNC_FREQUENCY, []).append(integration_id)
+        for frequency, integration_ids in by_frequency.items():
+            UserIntegration.objects.filter(id__in=integration_ids).update(next_sync_at=now + timedelta(hours=frequency))
+
+        yield [(provider, user_id) for _, provider, user_id, _ in chunk]
+
+def reschedule_user(user, sync_frequency, now=None):
+    """Bring a user's next syncs forward when they pick a shorter sync frequency"""
+    now = now or timezone.now()
+    next_sync_at = now + timedelta(hours=sync_frequency)
+    UserIntegration.objects.filter(user=user, next_sync_at__gt=next_sync_at).update(next_sync_at=next_sync_at)
+
+def upload_hours(integration, now=None):
+    """
+    Hours of the week (0 is Monday 00:00 UTC) in which the integration's new activities usually
+    start, from the last SYNC_PATTERN_DAYS days of history.
+    """
+    now = now or timezone.now()
+    counts = (
+        Activity.objects.filter(
+            user_id=integration.user_id,
+            source=integration.provider,
+            date__gte=now - timedelta(days=settings.SYNC_PATTERN_DAYS)
+        )
+        .annotate(weekday=ExtractIsoWeekDay('date'), hour=ExtractHour('date'))
+        .values('weekday', 'hour')
+        .annotate(count=Count('id'))
+    )
+    return {
+        (row['weekday'] - 1) * 24 + row['hour']
+        for row in counts
+        if row['count'] >= settings.SYNC_PATTERN_MIN_OCCURRENCES
+    }
+
+def has_daily_data(integration, now=None):
+    """Whether the integration has produced data on most recent days, as Whoop's daily metrics do"""
+    now = now or timezone.now()
+    if integration.provider != 'whoop':
+        return False
+    recent_days = HealthMetrics.objects.filter(
+        user_id=integration.user_id,
+        source=integration.provider,
+        date__gte=(now - timedelta(days=7)).date()
+    ).count()
+    return recent_days >= 4
+
+def next_sync_time(integration, sync_frequency, empty_streak, now=None):
+    """
+    When to sync an integration next, given its user's sync frequency and its empty sync streak.
+
+    The next sync falls in the window that opens one sync frequency after this sync and stays
+    open for one more, so an integration is never synced more often than its user asked. Within
+    the window the sync is moved up to shortly after the first hour in which the integration
+    usually has new data. Otherwise it is at the start of the window, or at its end after an
+    empty sync; integrations with daily data back off no further than a day.
+    """
+    now = now or timezone.now()
+    base = timedelta(hours=sync_frequency)
+    earliest = now + base
+    latest = earliest + base
+    fallback = latest if empty_streak else earliest
+    if has_daily_data(integration, now):
+        fallback = min(fallback, max(earliest, now + timedelta(days=1)))
+
+    hours = upload_hours(integration, now)
+    if hours:
+        lag = timedelta(hours=settings.SYNC_UPLOAD_LAG_HOURS)
+        candidate = earliest.replace(minute=0, second=0, microsecond=0)
+        while candidate < latest:
+            uploaded = candidate - lag
+            if uploaded.weekday() * 24 + uploaded.hour in hours and candidate >= earliest:
+                return candidate
+            candidate += timedelta(hours=1)
+    return fallback
+
+def schedule_next_sync(integration, found_data, now=None):
+    """Update an integration's empty sync streak after a successful sync and schedule its next sync"""
+    now = now or timezone.now()
+    empty_streak = 0 if found_data else integration.empty_sync_streak + 1
+    sync_frequency = UserSettings.objects.filter(user_id=integration.user_id).values_list('sync_frequency', flat=True).first()
+    next_sync_at = next_sync_time(integration, sync_frequency or DEFAULT_SYNC_FREQUENCY, empty_streak, now)
+
+    UserIntegration.objects.filter(id=integration.id).update(empty_sync_streak=empty_streak, next_sync_at=next_sync_at)
+    integration.empty_sync_streak = empty_streak
+    integration.next_sync_at = next_sync_at
+    logger.info(f"Next {integration.provider} sync for user ID {integration.user_id} at {next_sync_at} (empty streak {empty_streak})")
+    return next_sync_at
@@ -1,92 +1,328 @@
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from ..models import UserIntegration
+from ..http_client import carry_context, get_client
+from ..locks import TokenRefreshMixin, holds_sync_lease
+from core.ingest import upsert_activities
 from core.models import Activity
 from django.conf import settings
 from django.utils import timezone
 import logging
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-class StravaService:
-    BASE_URL = 'https://www.strava.com/api/v3'
+class StravaDetailFetcher:
+    """
+    Fetch detailed Strava activity records over a bounded pool of threads.
     
-    def __init__(self, user):
+    Strava only returns heart rate, cadence and calories reliably on the detailed activity, which
+    costs one request per activity. The requests are overlapped up to `max_workers` at a time and
+    the results are returned in the same order as the ids, with an empty dict for any activity
+    whose details could not be fetched.
+    """
+    
+    def __init__(self, access_token, base_url=None, max_workers=None):
+        self.access_token = access_token
+        self.base_url = base_url or settings.STRAVA_API_BASE_URL
+        self.max_workers = max_workers or settings.STRAVA_DETAIL_CONCURRENCY
+    
+    def fetch_one(self, activity_id):
+        """Fetch the detailed record for a single activity"""
+        detailed_url = f"{self.base_url}/activities/{activity_id}"
+        logger.info(f"Making request to {detailed_url}")
+        try:
+            response = get_client('strava').get(detailed_url, headers={'Authorization': f'Bearer {self.access_token}'})
+        except requests.RequestException as e:
+            logger.warning(f"Failed to get detailed data for activity {activity_id}: {str(e)}")
+            return {}
+        
+        if response.status_code != 200:
+            logger.warning(f"Failed to get detailed data for activity {activity_id}. Status: {response.status_code}, Response: {response.text[:200]}")
+            return {}
+        
+        try:
+            detailed_data = response.json()
+            logger.info(f"Detailed activity data keys for {activity_id}: {list(detailed_data.keys())}")
+            return detailed_data
+        except ValueError as e:
+            logger.error(f"Error parsing detailed activity data: {str(e)}, raw response: {response.text[:200]}")
+            return {}
+    
+    def fetch(self, activity_ids):
+        """Fetch detailed records for `activity_ids`, returned in the same order"""
+        activity_ids = list(activity_ids)
+        if not activity_ids:
+            return []
+        
+        workers = min(self.max_workers, len(activity_ids))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='strava-detail') as executor:
+            return list(executor.map(carry_context(self.fetch_one), activity_ids))
+
+class StravaService(TokenRefreshMixin):
+    BASE_URL = settings.STRAVA_API_BASE_URL
+    PER_PAGE = 200  # Maximum page size allowed by Strava
+    DETAIL_BATCH_SIZE = settings.STRAVA_DETAIL_BATCH_SIZE
+    
+    def __init__(self, user, detail_concurrency=None, integration=None):
         self.user = user
-        self.integration = UserIntegration.objects.get(user=user, provider='strava')
-    
-    def refresh_token_if_needed(self):
-        if self.integration.token_expires_at <= timezone.now():
-            logger.info("Strava token needs refresh")
-            response = requests.post(
-                'https://www.strava.com/oauth/token',
-                data={
-                    'client_id': settings.SOCIAL_AUTH_STRAVA_KEY,
-                    'client_secret': settings.SOCIAL_AUTH_STRAVA_SECRET,
-                    'grant_type': 'refresh_token',
-                    'refresh_token': self.integration.refresh_token
-                }
-            )
-            
-            if response.status_code != 200:
-                error_msg = f"Failed to refresh Strava token. Status: {response.status_code}, Response: {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
-            try:
-                data = response.json()
-                self.integration.access_token = data['access_token']
-                self.integration.refresh_token = data['refresh_token']
-                # Convert from timestamp to timezone-aware datetime
-                expires_at = datetime.fromtimestamp(data['expires_at'])
-                self.integration.token_expires_at = timezone.make_aware(expires_at)
-                self.integration.save()
-                logger.info("Successfully refreshed Strava token")
-            except (KeyError, ValueError) as e:
-                error_msg = f"Invalid response format from Strava: {str(e)}, Response: {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-    
-    def sync_activities(self):
-        logger.info(f"Starting sync activities for user {self.user.username}")
-        self.refresh_token_if_needed()
+        self.integration = integration or UserIntegration.objects.get(user=user, provider='strava')
+        self.detail_concurrency = detail_concurrency
+    
+    def refresh_token(self):
+        logger.info("Strava token needs refresh")
+        response = get_client('strava').post(
+            'https://www.strava.com/oauth/token',
+            data={
+                'client_id': settings.SOCIAL_AUTH_STRAVA_KEY,
+                'client_secret': settings.SOCIAL_AUTH_STRAVA_SECRET,
+                'grant_type': 'refresh_token',
+                'refresh_token': self.integration.refresh_token
+            }
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"Failed to refresh Strava token. Status: {response.status_code}, Response: {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
         
-        headers = {
+        try:
+            data = response.json()
+            self.integration.access_token = data['access_token']
+            self.integration.refresh_token = data['refresh_token']
+            # Convert from timestamp to timezone-aware datetime
+            expires_at = datetime.fromtimestamp(data['expires_at'])
+            self.integration.token_expires_at = timezone.make_aware(expires_at)
+            self.integration.save(update_fields=['access_token', 'refresh_token', 'token_expires_at'])
+            logger.info("Successfully refreshed Strava token")
+        except (KeyError, ValueError) as e:
+            error_msg = f"Invalid response format from Strava: {str(e)}, Response: {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+    
+    def get_headers(self):
+        """Get the headers for API requests"""
+        return {
             'Authorization': f'Bearer {self.integration.access_token}'
         }
+    
+    def detail_fetcher(self):
+        """Get a detail fetcher authorised with the current access token"""
+        return StravaDetailFetcher(self.integration.access_token, base_url=self.BASE_URL, max_workers=self.detail_concurrency)
+    
+    def iter_activity_pages(self, after=None, before=None):
+        """
+        Yield pages of summary activities started between `after` and `before` (epoch seconds).
         
-        # Get activities after last sync
-        after_timestamp = int(self.integration.last_sync.timestamp()) if self.integration.last_sync else None
-        logger.info(f"Syncing activities after timestamp: {after_timestamp}, last_sync: {self.integration.last_sync}")
+        Strava returns activities oldest-first when `after` is given, so instead of page numbers
+        the window's lower bound is moved up to the newest activity of each page. Only one page is
+        held in memory at a time and a walk can be resumed from any page boundary.
+        """
+        after = after or 0
+        previous_ids = set()
         
+        while True:
+            activities = self.fetch_activity_page(after, before)
+            page_size = len(activities)
+            
+            # The next window starts one second before the newest activity so that activities sharing
+            # its start second are not skipped; the ones already seen are dropped here
+            activities = [a for a in activities if a.get('id') not in previous_ids]
+            logger.info(f"Fetched page of {page_size} activities ({len(activities)} new) after {after}")
+            
+            if activities:
+                yield activities
+            
+            if page_size < self.PER_PAGE or not activities:
+                return
+            
+            newest = max(self.start_timestamp(a) for a in activities)
+            previous_ids = {a.get('id') for a in activities if self.start_timestamp(a) == newest}
+            after = newest - 1
+    
+    def fetch_activity_page(self, after, before=None):
+        """Fetch one page of summary activities started after `after`, oldest first"""
         params = {
-            'after': after_timestamp,
-            'per_page': 100
+            'after': after,
+            'per_page': self.PER_PAGE
         }
+        if before:
+            params['before'] = before
         
         logger.info(f"Making request to {self.BASE_URL}/athlete/activities with params: {params}")
-        response = requests.get(f'{self.BASE_URL}/athlete/activities', headers=headers, params=params)
+        response = get_client('strava').get(f'{self.BASE_URL}/athlete/activities', headers=self.get_headers(), params=params)
         if response.status_code != 200:
             error_msg = f"Failed to get activities from Strava. Status: {response.status_code}, Response: {response.text}"
             logger.error(error_msg)
             raise Exception(error_msg)
         
-        # Log the raw response for debugging
-        try:
-            response_text = response.text
-            logger.info(f"Raw response from Strava (first 500 chars): {response_text[:500]}")
-        except Exception as e:
-            logger.error(f"Error logging raw response: {str(e)}")
+        return response.json()
+    
+    @staticmethod
+    def start_timestamp(activity_data):
+        """Epoch seconds of a summary activity's start date"""
+        start_date = datetime.strptime(activity_data['start_date'], '%Y-%m-%dT%H:%M:%SZ')
+        return int(timezone.make_aware(start_date, dt_timezone.utc).timestamp())
+    
+    @holds_sync_lease
+    def sync_activities(self, after=None, before=None):
+        """
+        Sync activities from Strava page by page.
+        
+        Without an explicit window this is an incremental sync starting from `sync_cursor` (left
+        behind by an unfinished sync) or `last_sync`. The cursor is saved after every batch of
+        activities written, so an interrupted or rate-limited backfill picks up where it stopped
+        instead of starting over.
+        """
+        logger.info(f"Starting sync activities for user {self.user.username}")
+        self.refresh_token_if_needed()
+        
+        incremental = after is None
+        if incremental:
+            resume_from = self.integration.sync_cursor or self.integration.last_sync
+            after = int(resume_from.timestamp()) if resume_from else None
+            logger.info(f"Syncing activities after timestamp: {after}, last_sync: {self.integration.last_sync}, cursor: {self.integration.sync_cursor}")
+        else:
+            logger.info(f"Syncing activities in window after: {after}, before: {before}")
+        
+        totals = {
+            'total': 0,
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'details_fetched': 0,
+            'heart_rate': 0,
+            'cadence': 0
+        }
+        
+        def on_progress(counts, timestamp, boundary_ids):
+            if incremental:
+                # Resume from just before the last stored second; activities stored at it are
+                # unchanged on the next pass and cost no detail fetches
+                self.integration.sync_cursor = datetime.fromtimestamp(timestamp - 1, tz=dt_timezone.utc)
+                self.integration.save(update_fields=['sync_cursor'])
+            self.lease.extend()
+        
+        for page in self.iter_activity_pages(after=after, before=before):
+            counts = self.process_activity_page(page, on_progress=on_progress)
+            for key in totals:
+                totals[key] += counts[key]
+        
+        logger.info(f"Sync completed. Updated {totals['total']} activities ({totals['created']} created, {totals['updated']} updated, {totals['unchanged']} unchanged, {totals['details_fetched']} detail fetches). Heart rate data for {totals['heart_rate']}, cadence data for {totals['cadence']}")
+        
+        if incremental:
+            self.integration.last_sync = timezone.now()
+            self.integration.sync_cursor = None
+            self.integration.save(update_fields=['last_sync', 'sync_cursor'])
+        
+        return totals
+    
+    @holds_sync_lease
+    def resync_activities(self, since=None):
+        """
+        Forget the sync position and sync every activity started after `since`, or all of them.
+        
+        The reset happens under the sync lease so a sync already in flight cannot write its own
+        position over it.
+        """
+        self.integration.last_sync = since
+        self.integration.sync_cursor = None
+        self.integration.save(update_fields=['last_sync', 'sync_cursor'])
+        return self.sync_activities()
+    
+    # Summary fields that end up in our Activity rows; a change in any of them means the stored
+    # activity is out of date
+    FINGERPRINT_FIELDS = (
+        'type', 'start_date', 'moving_time', 'distance',
+        'has_heartrate', 'average_heartrate', 'average_cadence',
+    )
+    
+    @classmethod
+    def summary_fingerprint(cls, activity_data):
+        """Hash of the summary fields we store, used to detect unchanged activities"""
+        relevant = {field: activity_data.get(field) for field in cls.FINGERPRINT_FIELDS}
+        return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+    
+    @staticmethod
+    def needs_detail(activity_data, stored):
+        """Whether the detailed record would add anything the summary and stored row lack"""
+        missing_heart_rate = activity_data.get('has_heartrate') and activity_data.get('average_heartrate') is None
+        missing_cadence = activity_data.get('average_cadence') is None
+        missing_calories = stored is None or stored['calories'] is None
+        return missing_heart_rate or missing_cadence or missing_calories
+    
+    def process_activity_page(self, activities, on_progress=None):
+        """
+        Fetch details for and store the new or changed activities of one page.
+        
+        Activities are handled oldest first, DETAIL_BATCH_SIZE at a time, and each batch is written
+        as soon as its details are in. After each write `on_progress(counts, timestamp, boundary_ids)`
+        is called with the counts since the last call and how far the page is stored: every activity
+        started before `timestamp`, and those in `boundary_ids` started at it. If the rate limit is
+        reached part way through a page, the batches already written stay written and
+        RateLimitExceeded propagates, so the retry carries on from there.
+        """
+        activities = sorted(activities, key=self.start_timestamp)
+        stored_activities = {
+            stored['external_id']: stored
+            for stored in Activity.objects.filter(
+                user=self.user,
+                source='strava',
+                external_id__in=[str(a.get('id')) for a in activities]
+            ).values('external_id', 'summary_fingerprint', 'calories', 'average_heart_rate', 'average_cadence')
+        }
+        
+        # Counts not yet passed to on_progress, starting with the unchanged activities
+        pending = dict.fromkeys(('total', 'created', 'updated', 'unchanged', 'details_fetched', 'heart_rate', 'cadence'), 0)
+        totals = dict(pending)
+        changed = []
+        
+        for position, activity_data in enumerate(activities):
+            fingerprint = self.summary_fingerprint(activity_data)
+            stored = stored_activities.get(str(activity_data.get('id')))
+            if stored and stored['summary_fingerprint'] == fingerprint:
+                pending['total'] += 1
+                pending['unchanged'] += 1
+                if stored['average_heart_rate'] is not None:
+                    pending['heart_rate'] += 1
+                if stored['average_cadence'] is not None:
+                    pending['cadence'] += 1
+                continue
+            changed.append((position, activity_data, fingerprint, self.needs_detail(activity_data, stored)))
+        logger.info(f"Page of {len(activities)} activities: {pending['unchanged']} unchanged, {len(changed)} new or changed")
+        
+        fetcher = self.detail_fetcher()
+        for offset in range(0, max(len(changed), 1), self.DETAIL_BATCH_SIZE):
+            batch = changed[offset:offset + self.DETAIL_BATCH_SIZE]
+            if batch:
+                self.store_activity_batch(batch, fetcher, pending)
             
-        activities = response.json()
-        logger.info(f"Found {len(activities)} activities to sync")
+            # The last batch completes the page, including any unchanged activities after it
+            done = batch[-1][0] + 1 if offset + self.DETAIL_BATCH_SIZE < len(changed) else len(activities)
+            timestamp = self.start_timestamp(activities[done - 1])
+            boundary_ids = [a.get('id') for a in activities[:done] if self.start_timestamp(a) == timestamp]
+            for key, value in pending.items():
+                totals[key] += value
+            if on_progress:
+                on_progress(pending, timestamp, boundary_ids)
+            pending = dict.fromkeys(pending, 0)
         
-        activities_updated = 0
-        activities_with_hr = 0
-        activities_with_cadence = 0
+        return totals
+    
+    def store_activity_batch(self, batch, fetcher, counts):
+        """Fetch details for one batch of new or changed activities and write it, adding to `counts`"""
+        # Get detailed activity data to access heart rate and cadence, only where the summary lacks
+        # it. The fetches overlap but the results come back in order for the writes below.
+        detail_ids = [activity_data.get('id') for _, activity_data, _, fetch in batch if fetch]
+        fetched = iter(fetcher.fetch(detail_ids))
+        details = [next(fetched) if fetch else {} for _, _, _, fetch in batch]
+        counts['details_fetched'] += len(detail_ids)
+        
+        rows = []
         
-        for activity_data in activities:
+        for (_, activity_data, fingerprint, fetch), detailed_data in zip(batch, details):
             try:
                 # Log basic activity info
                 activity_id = activity_data.get('id')
@@ -96,25 +332,8 @@ class StravaService:
                 
                 logger.info(f"Processing activity: {activity_id} - {activity_name} ({activity_type}) on {activity_date}")
                 
-                # Get detailed activity data to access heart rate and cadence
-                logger.info(f"Getting detailed data for activity: {activity_id}")
-                detailed_url = f"{self.BASE_URL}/activities/{activity_id}"
-                logger.info(f"Making request to {detailed_url}")
-                detailed_response = requests.get(detailed_url, headers=headers)
-                
-                detailed_data = {}
-                if detailed_response.status_code == 200:
-                    try:
-                        detailed_data = detailed_response.json()
-                        # Log the keys in detailed data for debugging
-                        logger.info(f"Detailed activity data keys for {activity_id}: {list(detailed_data.keys())}")
-                        
-                        # Merge the detailed data with the basic data, with detailed data taking precedence
-                        activity_data.update(detailed_data)
-                    except Exception as e:
-                        logger.error(f"Error parsing detailed activity data: {str(e)}, raw response: {detailed_response.text[:200]}")
-                else:
-                    logger.warning(f"Failed to get detailed data for activity {activity_id}. Status: {detailed_response.status_code}, Response: {detailed_response.text[:200]}")
+                # Merge the detailed data with the basic data, with detailed data taking precedence
+                activity_data.update(detailed_data)
                 
                 # Log all keys that might be related to heart rate and cadence
                 for key in activity_data.keys():
@@ -143,55 +362,41 @@ class StravaService:
                 start_date = datetime.strptime(activity_data['start_date'], '%Y-%m-%dT%H:%M:%SZ')
                 start_date_aware = timezone.make_aware(start_date)
                 
-                # Prepare defaults dict with non-null values only
-                defaults = {
+                # Prepare the row with non-null values only so existing data is never blanked out
+                row = {
+                    'external_id': str(activity_id),
+                    # Without the details it needed the activity must not look up to date, or it
+                    # would never be fetched again
+                    'summary_fingerprint': fingerprint if detailed_data or not fetch else None,
                     'date': start_date_aware,
                     'activity_type': activity_data['type'],
                     'duration': timedelta(seconds=activity_data['moving_time']),
                     'distance': activity_data['distance'] / 1000,
-                    'source': 'strava'
                 }
                 
                 # Add optional fields only if they have values
                 if 'calories' in activity_data and activity_data['calories'] is not None:
-                    defaults['calories'] = activity_data['calories']
+                    row['calories'] = activity_data['calories']
                 
                 if heart_rate is not None:
-                    defaults['average_heart_rate'] = heart_rate
+                    row['average_heart_rate'] = heart_rate
                 
                 if cadence is not None:
-                    defaults['average_cadence'] = cadence
-                
-                activity, created = Activity.objects.update_or_create(
-                    user=self.user,
-                    source='strava',
-                    external_id=str(activity_id),
-                    defaults=defaults
-                )
+                    row['average_cadence'] = cadence
                 
-                activities_updated += 1
+                rows.append(row)
                 if heart_rate is not None:
-                    activities_with_hr += 1
+                    counts['heart_rate'] += 1
                 if cadence is not None:
-                    activities_with_cadence += 1
-                
-                if created:
-                    logger.info(f"Created new activity: {activity_id}")
-                else:
-                    logger.info(f"Updated existing activity: {activity_id}")
+                    counts['cadence'] += 1
                 
             except Exception as e:
                 logger.error(f"Error processing activity {activity_data.get('id', 'unknown')}: {str(e)}")
                 import traceback
                 logger.error(traceback.format_exc())
         
-        logger.info(f"Sync completed. Updated {activities_updated} activities. Heart rate data for {activities_with_hr}, cadence data for {activities_with_cadence}")
-        
-        self.integration.last_sync = timezone.now()
-        self.integration.save()
-        
-        return {
-            'total': activities_updated,
-            'heart_rate': activities_with_hr,
-            'cadence': activities_with_cadence
-        } 
\ No newline at end of file
+        # Write the whole batch in one transaction
+        written = upsert_activities(self.user, 'strava', rows)
+        counts['total'] += len(rows)
+        counts['created'] += written['created']
+        counts['updated'] += written['updated']
@@ -1,69 +1,190 @@
-import requests
 from datetime import datetime, timedelta
 from ..models import UserIntegration
-from core.models import HealthMetrics, Activity
+from ..http_client import carry_context, get_client
+from ..locks import TokenRefreshMixin, holds_sync_lease
+from ..ratelimit import RateLimitExceeded
+from core.ingest import delete_activities, upsert_activities, upsert_health_metrics
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-class WhoopService:
+def assemble_daily_metrics(*row_lists):
+    """
+    Combine HealthMetrics rows for the same date into one row per day.
+    
+    Later rows win for fields present in more than one row for a date.
+    """
+    days = {}
+    for rows in row_lists:
+        for row in rows:
+            days.setdefault(row['date'], {}).update(row)
+    return [days[date] for date in sorted(days)]
+
+class WhoopService(TokenRefreshMixin):
     BASE_URL = 'https://api.prod.whoop.com/developer/v1'
+    PAGE_LIMIT = 25  # Maximum allowed limit per documentation
+    
+    # Collection name: (endpoint, record converter, writer)
+    COLLECTIONS = {
+        'workouts': ('/activity/workout', 'workout_row', upsert_activities),
+        'recovery data': ('/recovery', 'recovery_row', upsert_health_metrics),
+        'sleep data': ('/activity/sleep', 'sleep_row', upsert_health_metrics),
+    }
+    
+    # Webhook resource type: (endpoint for one record, record converter)
+    RESOURCES = {
+        'workout': ('/activity/workout/{id}', 'workout_row'),
+        'sleep': ('/activity/sleep/{id}', 'sleep_row'),
+        # Whoop identifies a recovery by the cycle it belongs to
+        'recovery': ('/cycle/{id}/recovery', 'recovery_row'),
+    }
     
-    def __init__(self, user):
+    def __init__(self, user, integration=None):
         self.user = user
-        self.integration = UserIntegration.objects.get(user=user, provider='whoop')
+        self.integration = integration or UserIntegration.objects.get(user=user, provider='whoop')
     
-    def refresh_token_if_needed(self):
-        """Refresh the access token if it's expired or about to expire"""
-        # Add a buffer of 5 minutes to avoid edge cases
-        if self.integration.token_expires_at <= timezone.now() + timedelta(minutes=5):
-            logger.info(f"Refreshing Whoop token for user {self.user.username}")
+    def refresh_token(self):
+        logger.info(f"Refreshing Whoop token for user {self.user.username}")
+        try:
+            response = get_client('whoop').post(
+                'https://api.prod.whoop.com/oauth/oauth2/token',
+                data={
+                    'grant_type': 'refresh_token',
+                    'refresh_token': self.integration.refresh_token,
+                    'client_id': settings.SOCIAL_AUTH_WHOOP_KEY,
+                    'client_secret': settings.SOCIAL_AUTH_WHOOP_SECRET,
+                }
+            )
+            
+            if response.status_code != 200:
+                error_msg = f"Failed to refresh Whoop token. Status: {response.status_code}, Response: {response.text}"
+                logger.error(error_msg)
+                raise Exception(error_msg)
+            
             try:
-                response = requests.post(
-                    'https://api.prod.whoop.com/oauth/oauth2/token',
-                    data={
-                        'grant_type': 'refresh_token',
-                        'refresh_token': self.integration.refresh_token,
-                        'client_id': settings.SOCIAL_AUTH_WHOOP_KEY,
-                        'client_secret': settings.SOCIAL_AUTH_WHOOP_SECRET,
-                    }
-                )
-                
-                if response.status_code != 200:
-                    error_msg = f"Failed to refresh Whoop token. Status: {response.status_code}, Response: {response.text}"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-                
-                try:
-                    data = response.json()
-                    self.integration.access_token = data['access_token']
-                    self.integration.refresh_token = data['refresh_token']
-                    self.integration.token_expires_at = timezone.now() + timedelta(seconds=data['expires_in'])
-                    self.integration.save()
-                    logger.info(f"Successfully refreshed Whoop token for user {self.user.username}")
-                except (KeyError, ValueError) as e:
-                    error_msg = f"Invalid response format from Whoop: {str(e)}, Response: {response.text}"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-            except Exception as e:
-                logger.error(f"Error refreshing Whoop token: {str(e)}")
-                raise
+                data = response.json()
+                self.integration.access_token = data['access_token']
+                self.integration.refresh_token = data['refresh_token']
+                self.integration.token_expires_at = timezone.now() + timedelta(seconds=data['expires_in'])
+                self.integration.save(update_fields=['access_token', 'refresh_token', 'token_expires_at'])
+                logger.info(f"Successfully refreshed Whoop token for user {self.user.username}")
+            except (KeyError, ValueError) as e:
+                error_msg = f"Invalid response format from Whoop: {str(e)}, Response: {response.text}"
+                logger.error(error_msg)
+                raise Exception(error_msg)
+        except Exception as e:
+            logger.error(f"Error refreshing Whoop token: {str(e)}")
+            raise
     
-    def sync_data(self):
-        """Sync all Whoop data for the user"""
+    @holds_sync_lease
+    def sync_data(self, start=None, end=None):
+        """
+        Sync all Whoop data for the user.
+        
+        The workout, recovery and sleep collections are fetched concurrently and then written
+        together, so a sync takes about as long as the slowest collection. Pass `start` and `end`
+        to backfill a historic window; last_sync only moves forward for regular syncs.
+        """
         self.refresh_token_if_needed()
+        fetch_start = start or self.default_start()
+        
+        # Fetch workouts, recovery, and sleep data
+        with ThreadPoolExecutor(max_workers=len(self.COLLECTIONS), thread_name_prefix='whoop-fetch') as executor:
+            futures = {
+                name: executor.submit(carry_context(self.fetch_collection), name, fetch_start, end)
+                for name in self.COLLECTIONS
+            }
+        
+        fetched = {}
+        for name, future in futures.items():
+            try:
+                fetched[name] = future.result()
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Error syncing Whoop {name}: {str(e)}")
+                logger.exception("Exception details:")
+                fetched[name] = []
+        
+        # Recovery and sleep land on the same HealthMetrics day, so combine them in memory and
+        # write each day once
+        daily_metrics = assemble_daily_metrics(fetched['recovery data'], fetched['sleep data'])
         
-        # Sync workouts, recovery, and sleep data
-        self.sync_workouts()
-        self.sync_recovery()
-        self.sync_sleep()
+        # Write everything in one transaction
+        with transaction.atomic():
+            workouts = upsert_activities(self.user, 'whoop', fetched['workouts'])
+            metrics = upsert_health_metrics(self.user, 'whoop', daily_metrics)
         
         # Update last sync time
-        self.integration.last_sync = timezone.now()
-        self.integration.save()
+        if start is None and end is None:
+            self.integration.last_sync = timezone.now()
+            self.integration.save(update_fields=['last_sync'])
         logger.info(f"Completed Whoop sync for user {self.user.username}")
+        return {
+            'workouts': workouts,
+            'metrics': metrics
+        }
+    
+    @holds_sync_lease
+    def sync_resources(self, resources):
+        """
+        Sync only the Whoop records named by webhook events.
+        
+        `resources` is a list of (type, id, action). Each record is fetched on its own and written
+        the same way sync_data writes it; deleted workouts are removed. Raises if a record cannot
+        be fetched, so the caller can fall back to a windowed sync. last_sync is left alone.
+        """
+        self.refresh_token_if_needed()
+        
+        rows = {'workout': [], 'recovery': [], 'sleep': []}
+        deleted_workouts = []
+        for resource_type, resource_id, action in resources:
+            if action == 'deleted':
+                if resource_type == 'workout':
+                    deleted_workouts.append(str(resource_id))
+                else:
+                    logger.info(f"Ignoring deleted Whoop {resource_type} {resource_id} for user {self.user.username}")
+                continue
+            
+            row = self.fetch_resource(resource_type, resource_id)
+            if row:
+                rows[resource_type].append(row)
+        
+        daily_metrics = assemble_daily_metrics(rows['recovery'], rows['sleep'])
+        with transaction.atomic():
+            workouts = upsert_activities(self.user, 'whoop', rows['workout'])
+            metrics = upsert_health_metrics(self.user, 'whoop', daily_metrics)
+            if deleted_workouts:
+                workouts['deleted'] = delete_activities(self.user, 'whoop', deleted_workouts)
+        
+        logger.info(f"Synced {len(resources)} Whoop webhook resources for user {self.user.username}")
+        return {
+            'workouts': workouts,
+            'metrics': metrics
+        }
+    
+    def fetch_resource(self, resource_type, resource_id):
+        """Fetch and convert one record, or None if Whoop no longer has it"""
+        path, converter = self.RESOURCES[resource_type]
+        path = path.format(id=resource_id)
+        response = get_client('whoop').get(
+            f'{self.BASE_URL}{path}',
+            headers=self.get_headers()
+        )
+        
+        if response.status_code == 404:
+            logger.info(f"Whoop {resource_type} {resource_id} no longer exists")
+            return None
+        if response.status_code != 200:
+            error_msg = f"Error fetching Whoop {path}: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        
+        return getattr(self, converter)(response.json())
     
     def get_headers(self):
         """Get the headers for API requests"""
@@ -72,220 +193,179 @@ class WhoopService:
             'Content-Type': 'application/json'
         }
     
-    def sync_workouts(self):
-        """Sync workout data from Whoop"""
-        logger.info(f"Syncing Whoop workouts for user {self.user.username}")
-        try:
-            # Get data since last sync or last 30 days
-            start_date = self.integration.last_sync or (timezone.now() - timedelta(days=30))
-            start_date_str = start_date.isoformat()
-            
-            logger.info(f"Using start date: {start_date_str}")
-            
-            # Use the correct workout endpoint with the proper parameters
-            logger.info(f"Making request to {self.BASE_URL}/activity/workout")
-            response = requests.get(
-                f'{self.BASE_URL}/activity/workout',
+    def default_start(self):
+        """Get data since last sync or last 30 days"""
+        return self.integration.last_sync or (timezone.now() - timedelta(days=30))
+    
+    def iter_collection(self, path, start, end=None):
+        """
+        Yield pages of records from a Whoop v1 collection endpoint between `start` and `end`.
+        
+        Follows the `next_token` of each response until the collection is exhausted, so gaps
+        longer than one page are never dropped. Only one page is held in memory at a time.
+        """
+        params = {
+            'start': start.isoformat(),
+            'limit': self.PAGE_LIMIT
+        }
+        if end:
+            params['end'] = end.isoformat()
+        
+        while True:
+            logger.info(f"Making request to {self.BASE_URL}{path} with params: {params}")
+            response = get_client('whoop').get(
+                f'{self.BASE_URL}{path}',
                 headers=self.get_headers(),
-                params={
-                    'start': start_date_str,
-                    'limit': 25  # Maximum allowed limit per documentation
-                }
+                params=params
             )
             
-            logger.info(f"Response status code: {response.status_code}")
-            logger.info(f"Response headers: {response.headers}")
-            
             if response.status_code != 200:
-                logger.error(f"Error fetching Whoop workouts: {response.status_code} - {response.text}")
-                return
+                error_msg = f"Error fetching Whoop {path}: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise Exception(error_msg)
             
-            workouts_data = response.json()
-            logger.info(f"Response data type: {type(workouts_data)}")
-            logger.info(f"Response data: {workouts_data}")
+            data = response.json()
             
             # The API returns records in a 'records' field
-            workouts = workouts_data.get('records', [])
-            logger.info(f"Retrieved {len(workouts)} Whoop workouts")
+            records = data.get('records', [])
+            logger.info(f"Retrieved {len(records)} records from {path}")
+            if records:
+                yield records
             
-            for workout in workouts:
-                # Convert Whoop workout to Activity model
+            next_token = data.get('next_token')
+            if not next_token:
+                return
+            params['nextToken'] = next_token
+    
+    def workout_row(self, workout):
+        """Convert a Whoop workout to Activity field values"""
+        start_time = datetime.fromisoformat(workout.get('start', '').replace('Z', '+00:00'))
+        
+        # Extract sport type from the workout data
+        sport_name = "Workout"  # Default value
+        if 'sport' in workout:
+            sport_name = workout.get('sport', {}).get('name', 'Workout')
+        
+        # Calculate duration from start and end times if duration not provided
+        duration_seconds = 0
+        if 'end' in workout and 'start' in workout:
+            end_time = datetime.fromisoformat(workout.get('end', '').replace('Z', '+00:00'))
+            duration = end_time - start_time
+            duration_seconds = duration.total_seconds()
+        
+        return {
+            'external_id': str(workout.get('id')),
+            'date': start_time,
+            'activity_type': sport_name,
+            'duration': timedelta(seconds=duration_seconds),
+            'distance': workout.get('distance_meter', 0) / 1000,  # Convert to km
+            'calories': workout.get('calories'),
+        }
+    
+    def recovery_row(self, recovery):
+        """Convert a Whoop recovery to HealthMetrics field values, or None if it has no date"""
+        # Get the score data
+        score = recovery.get('score', {})
+        
+        # Parse date from the recovery data - use created_at as fallback
+        recovery_date = None
+        if 'created_at' in recovery:
+            recovery_date = datetime.fromisoformat(recovery.get('created_at', '').replace('Z', '+00:00')).date()
+        
+        if not recovery_date:
+            logger.warning(f"Could not determine date for recovery record: {recovery}")
+            return None
+        
+        return {
+            'date': recovery_date,
+            'resting_heart_rate': score.get('resting_heart_rate'),
+            'hrv': score.get('hrv_rmssd_milli'),
+            'recovery_score': score.get('recovery_score', 0),  # Already in percentage (0-100)
+        }
+    
+    def sleep_row(self, sleep):
+        """Convert a Whoop sleep to HealthMetrics field values"""
+        # Parse date from the sleep data - the night belongs to the day it ends
+        end_time = datetime.fromisoformat(sleep.get('end', '').replace('Z', '+00:00'))
+        
+        # Get sleep duration from the score data
+        score = sleep.get('score', {})
+        stage_summary = score.get('stage_summary', {})
+        
+        # Calculate total sleep time in milliseconds, then convert to seconds
+        total_sleep_ms = (
+            stage_summary.get('total_light_sleep_time_milli', 0) +
+            stage_summary.get('total_slow_wave_sleep_time_milli', 0) +
+            stage_summary.get('total_rem_sleep_time_milli', 0)
+        )
+        
+        return {
+            'date': end_time.date(),
+            'sleep_duration': timedelta(seconds=total_sleep_ms / 1000),
+        }
+    
+    def fetch_collection(self, name, start, end=None):
+        """Fetch and convert every record of a collection without writing anything"""
+        path, to_row, _ = self.collection(name)
+        rows = []
+        for records in self.iter_collection(path, start, end):
+            for record in records:
                 try:
-                    start_time = datetime.fromisoformat(workout.get('start', '').replace('Z', '+00:00'))
-                    
-                    # Extract sport type from the workout data
-                    sport_name = "Workout"  # Default value
-                    if 'sport' in workout:
-                        sport_name = workout.get('sport', {}).get('name', 'Workout')
-                    
-                    # Calculate duration from start and end times if duration not provided
-                    duration_seconds = 0
-                    if 'end' in workout and 'start' in workout:
-                        end_time = datetime.fromisoformat(workout.get('end', '').replace('Z', '+00:00'))
-                        duration = end_time - start_time
-                        duration_seconds = duration.total_seconds()
-                    
-                    Activity.objects.update_or_create(
-                        user=self.user,
-                        source='whoop',
-                        external_id=str(workout.get('id')),
-                        defaults={
-                            'date': start_time,
-                            'activity_type': sport_name,
-                            'duration': timedelta(seconds=duration_seconds),
-                            'distance': workout.get('distance_meter', 0) / 1000,  # Convert to km
-                            'calories': workout.get('calories'),
-                        }
-                    )
+                    row = to_row(record)
+                    if row:
+                        rows.append(row)
                 except Exception as e:
-                    logger.error(f"Error processing Whoop workout: {str(e)}")
+                    logger.error(f"Error processing Whoop {name} record: {str(e)}")
                     logger.exception("Exception details:")
-        except Exception as e:
-            logger.error(f"Error syncing Whoop workouts: {str(e)}")
-            logger.exception("Exception details:")
+        logger.info(f"Fetched {len(rows)} Whoop {name} records for user {self.user.username}")
+        return rows
     
-    def sync_recovery(self):
-        """Sync recovery data from Whoop"""
-        logger.info(f"Syncing Whoop recovery data for user {self.user.username}")
+    def collection(self, name):
+        """Endpoint, record converter and writer for a collection"""
+        path, converter, upsert = self.COLLECTIONS[name]
+        return path, getattr(self, converter), upsert
+    
+    @holds_sync_lease
+    def sync_collection(self, name, start=None, end=None):
+        """Stream a collection page by page, converting and upserting each page as it arrives"""
+        path, to_row, upsert = self.collection(name)
+        logger.info(f"Syncing Whoop {name} for user {self.user.username}")
+        totals = {'created': 0, 'updated': 0}
         try:
-            # Get data since last sync or last 30 days
-            start_date = self.integration.last_sync or (timezone.now() - timedelta(days=30))
-            start_date_str = start_date.isoformat()
-            
-            logger.info(f"Using start date: {start_date_str}")
-            
-            # Use the correct recovery endpoint with the proper parameters
-            logger.info(f"Making request to {self.BASE_URL}/recovery")
-            response = requests.get(
-                f'{self.BASE_URL}/recovery',
-                headers=self.get_headers(),
-                params={
-                    'start': start_date_str,
-                    'limit': 25  # Maximum allowed limit per documentation
-                }
-            )
-            
-            logger.info(f"Response status code: {response.status_code}")
-            logger.info(f"Response headers: {response.headers}")
-            
-            if response.status_code != 200:
-                logger.error(f"Error fetching Whoop recovery data: {response.status_code} - {response.text}")
-                return
-            
-            recoveries_data = response.json()
-            logger.info(f"Response data type: {type(recoveries_data)}")
-            logger.info(f"Response data: {recoveries_data}")
-            
-            # The API returns records in a 'records' field
-            recoveries = recoveries_data.get('records', [])
-            logger.info(f"Retrieved {len(recoveries)} Whoop recovery records")
+            start = start or self.default_start()
+            logger.info(f"Using start date: {start.isoformat()}, end date: {end.isoformat() if end else None}")
             
-            for recovery in recoveries:
-                try:
-                    # Get the cycle_id from the recovery data
-                    cycle_id = recovery.get('cycle_id')
-                    
-                    # Get the score data
-                    score = recovery.get('score', {})
-                    
-                    # Parse date from the recovery data - use created_at as fallback
-                    recovery_date = None
-                    if 'created_at' in recovery:
-                        recovery_date = datetime.fromisoformat(recovery.get('created_at', '').replace('Z', '+00:00')).date()
-                    
-                    if not recovery_date:
-                        logger.warning(f"Could not determine date for recovery record: {recovery}")
-                        continue
-                    
-                    # Update or create health metrics
-                    HealthMetrics.objects.update_or_create(
-                        user=self.user,
-                        date=recovery_date,
-                        defaults={
-                            'resting_heart_rate': score.get('resting_heart_rate'),
-                            'hrv': score.get('hrv_rmssd_milli'),
-                            'recovery_score': score.get('recovery_score', 0),  # Already in percentage (0-100)
-                            'source': 'whoop'
-                        }
-                    )
-                except Exception as e:
-                    logger.error(f"Error processing Whoop recovery: {str(e)}")
-                    logger.exception("Exception details:")
+            for records in self.iter_collection(path, start, end):
+                rows = []
+                for record in records:
+                    try:
+                        row = to_row(record)
+                        if row:
+                            rows.append(row)
+                    except Exception as e:
+                        logger.error(f"Error processing Whoop {name} record: {str(e)}")
+                        logger.exception("Exception details:")
+                
+                written = upsert(self.user, 'whoop', rows)
+                totals['created'] += written['created']
+                totals['updated'] += written['updated']
+        except RateLimitExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Error syncing Whoop recovery data: {str(e)}")
+            logger.error(f"Error syncing Whoop {name}: {str(e)}")
             logger.exception("Exception details:")
+        
+        logger.info(f"Synced Whoop {name} for user {self.user.username}: {totals['created']} created, {totals['updated']} updated")
+        return totals
+    
+    def sync_workouts(self, start=None, end=None):
+        """Sync workout data from Whoop"""
+        return self.sync_collection('workouts', start, end)
     
-    def sync_sleep(self):
+    def sync_recovery(self, start=None, end=None):
+        """Sync recovery data from Whoop"""
+        return self.sync_collection('recovery data', start, end)
+    
+    def sync_sleep(self, start=None, end=None):
         """Sync sleep data from Whoop"""
-        logger.info(f"Syncing Whoop sleep data for user {self.user.username}")
-        try:
-            # Get data since last sync or last 30 days
-            start_date = self.integration.last_sync or (timezone.now() - timedelta(days=30))
-            start_date_str = start_date.isoformat()
-            
-            logger.info(f"Using start date: {start_date_str}")
-            
-            # Use the correct sleep endpoint with the proper parameters
-            logger.info(f"Making request to {self.BASE_URL}/activity/sleep")
-            response = requests.get(
-                f'{self.BASE_URL}/activity/sleep',
-                headers=self.get_headers(),
-                params={
-                    'start': start_date_str,
-                    'limit': 25  # Maximum allowed limit per documentation
-                }
-            )
-            
-            logger.info(f"Response status code: {response.status_code}")
-            logger.info(f"Response headers: {response.headers}")
-            
-            if response.status_code != 200:
-                logger.error(f"Error fetching Whoop sleep data: {response.status_code} - {response.text}")
-                return
-            
-            sleeps_data = response.json()
-            logger.info(f"Response data type: {type(sleeps_data)}")
-            logger.info(f"Response data: {sleeps_data}")
-            
-            # The API returns records in a 'records' field
-            sleeps = sleeps_data.get('records', [])
-            logger.info(f"Retrieved {len(sleeps)} Whoop sleep records")
-            
-            for sleep in sleeps:
-                try:
-                    # Parse date from the sleep data - updated to match API response format
-                    start_time = datetime.fromisoformat(sleep.get('start', '').replace('Z', '+00:00'))
-                    end_time = datetime.fromisoformat(sleep.get('end', '').replace('Z', '+00:00'))
-                    sleep_date = end_time.date()
-                    
-                    # Get sleep duration from the score data
-                    score = sleep.get('score', {})
-                    stage_summary = score.get('stage_summary', {})
-                    
-                    # Calculate total sleep time in milliseconds, then convert to seconds
-                    total_sleep_ms = (
-                        stage_summary.get('total_light_sleep_time_milli', 0) +
-                        stage_summary.get('total_slow_wave_sleep_time_milli', 0) +
-                        stage_summary.get('total_rem_sleep_time_milli', 0)
-                    )
-                    sleep_duration_seconds = total_sleep_ms / 1000
-                    
-                    # Update or create health metrics
-                    metrics, created = HealthMetrics.objects.get_or_create(
-                        user=self.user,
-                        date=sleep_date,
-                        defaults={
-                            'sleep_duration': timedelta(seconds=sleep_duration_seconds),
-                            'source': 'whoop'
-                        }
-                    )
-                    
-                    if not created:
-                        metrics.sleep_duration = timedelta(seconds=sleep_duration_seconds)
-                        metrics.save(update_fields=['sleep_duration'])
-                except Exception as e:
-                    logger.error(f"Error processing Whoop sleep: {str(e)}")
-                    logger.exception("Exception details:")
-        except Exception as e:
-            logger.error(f"Error syncing Whoop sleep data: {str(e)}")
-            logger.exception("Exception details:") 
\ No newline at end of file
+        return self.sync_collection('sleep data', start, end)
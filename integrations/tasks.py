@@ -1,15 +1,25 @@
 from celery import shared_task
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta
+from uuid import uuid4
 from .services.strava import StravaService
 from .services.whoop import WhoopService
-from .models import UserIntegration
+from .models import FullResyncJob, UserIntegration
+from . import ledger, tokens
+from .ledger import SyncRunRecorder
+from .locks import IntegrationLease, SyncInProgress
+from .ratelimit import RateLimitExceeded
+from .scheduler import iter_due_integrations
+from .webhooks import claim_webhook_events
 from core.utils import handle_integration_errors
 import logging
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
-@shared_task
+@shared_task(ignore_result=True)
 @handle_integration_errors
 def sync_user_data(user_id):
     user = User.objects.get(id=user_id)
@@ -20,6 +30,8 @@ def sync_user_data(user_id):
         StravaService(user).sync_activities()
     except UserIntegration.DoesNotExist:
         pass
+    except SyncInProgress as e:
+        logger.info(f"Skipping Strava sync for user {user.username}: {str(e)}")
     
     # Sync Whoop data
     try:
@@ -27,56 +39,245 @@ def sync_user_data(user_id):
         WhoopService(user).sync_data()
     except UserIntegration.DoesNotExist:
         pass
+    except SyncInProgress as e:
+        logger.info(f"Skipping Whoop sync for user {user.username}: {str(e)}")
 
-@shared_task
+@shared_task(ignore_result=True)
 def sync_all_users():
-    """Sync data for all users with active integrations"""
+    """Sync data for integrations that are due according to their users' sync frequency"""
     logger.info("Starting sync for all users")
     
-    # Sync Strava
-    strava_integrations = UserIntegration.objects.filter(provider='strava')
-    for integration in strava_integrations:
-        sync_strava_user.delay(integration.user_id)
+    due = iter_due_integrations()
     
-    # Sync Whoop
-    whoop_integrations = UserIntegration.objects.filter(provider='whoop')
-    for integration in whoop_integrations:
-        sync_whoop_user.delay(integration.user_id)
+    if settings.SYNC_DRIVER == 'asyncio':
+        # Run every sync from this worker process instead of queueing a task per integration
+        from .driver import AsyncSyncDriver
+        driver = AsyncSyncDriver()
+        for jobs in due:
+            driver.run(jobs)
+        logger.info("Finished sync for all users")
+        return
     
-    logger.info("Finished queueing sync tasks for all users")
+    queued = 0
+    for jobs in due:
+        for provider, user_id in jobs:
+            if provider == 'strava':
+                sync_strava_user.delay(user_id)
+            else:
+                sync_whoop_user.delay(user_id)
+        queued += len(jobs)
+    
+    logger.info(f"Finished queueing {queued} sync tasks for all users")
 
-@shared_task
-def sync_strava_user(user_id):
-    """Sync Strava data for a specific user"""
+@shared_task(bind=True, max_retries=5, ignore_result=True)
+def sync_strava_user(self, user_id, lock_wait=0):
+    """
+    Sync Strava data for a specific user.
+    
+    `lock_wait` is how long to wait for a sync of the same integration that is already running;
+    syncs a user asked for wait, background syncs skip. Each run is recorded in the SyncRun
+    ledger instead of the Celery result backend.
+    """
     try:
-        user = User.objects.get(id=user_id)
-        logger.info(f"Starting Strava sync for user {user.username}")
-        
-        service = StravaService(user)
-        service.sync_activities()
-        
-        logger.info(f"Completed Strava sync for user {user.username}")
+        with SyncRunRecorder('interactive' if lock_wait else 'scheduled', self.request.id) as run:
+            user = User.objects.get(id=user_id)
+            logger.info(f"Starting Strava sync for user {user.username}")
+            
+            service = StravaService(user)
+            run.integration = service.integration
+            run.finish(service.sync_activities(lock_wait=lock_wait))
+            
+            logger.info(f"Completed Strava sync for user {user.username}")
     except User.DoesNotExist:
         logger.error(f"User with ID {user_id} not found")
     except UserIntegration.DoesNotExist:
         logger.error(f"No Strava integration found for user ID {user_id}")
+    except SyncInProgress:
+        # The sync already running will pick up the same activities
+        logger.info(f"Strava sync already running for user ID {user_id}, skipping")
+    except RateLimitExceeded as e:
+        # Come back when the provider's window has room instead of burning requests on 429s
+        logger.warning(f"Strava rate limit reached for user ID {user_id}, retrying in {e.retry_after:.0f}s")
+        raise self.retry(countdown=e.retry_after, exc=e)
     except Exception as e:
         logger.error(f"Error syncing Strava data for user ID {user_id}: {str(e)}")
 
-@shared_task
-def sync_whoop_user(user_id):
-    """Sync Whoop data for a specific user"""
+@shared_task(bind=True, max_retries=5, ignore_result=True)
+def sync_whoop_user(self, user_id, webhook=False, lock_wait=0):
+    """
+    Sync Whoop data for a specific user.
+    
+    Syncs scheduled by webhooks fetch only the records the events named, falling back to a
+    windowed sync when an event could not be resolved to a single record. `lock_wait` and the
+    ledger are as for sync_strava_user.
+    """
+    trigger = 'webhook' if webhook else 'interactive' if lock_wait else 'scheduled'
     try:
-        user = User.objects.get(id=user_id)
-        logger.info(f"Starting Whoop sync for user {user.username}")
-        
-        service = WhoopService(user)
-        service.sync_data()
-        
-        logger.info(f"Completed Whoop sync for user {user.username}")
+        with SyncRunRecorder(trigger, self.request.id) as run:
+            user = User.objects.get(id=user_id)
+            logger.info(f"Starting Whoop sync for user {user.username}")
+            
+            claimed = claim_webhook_events(user_id)
+            run.webhook_events = claimed['events']
+            if claimed['events']:
+                logger.info(f"Whoop sync for user {user.username} absorbed {claimed['events']} webhook event(s)")
+            elif webhook:
+                logger.info(f"Webhook events for user {user.username} were already synced")
+                return
+            
+            service = WhoopService(user)
+            run.integration = service.integration
+            if webhook and claimed['resources'] and not claimed['unresolved']:
+                try:
+                    run.finish(service.sync_resources(claimed['resources']))
+                except RateLimitExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Targeted Whoop sync failed for user {user.username}, falling back to a windowed sync: {str(e)}")
+                    run.finish(service.sync_data())
+            else:
+                run.finish(service.sync_data(lock_wait=lock_wait))
+            
+            logger.info(f"Completed Whoop sync for user {user.username}")
     except User.DoesNotExist:
         logger.error(f"User with ID {user_id} not found")
     except UserIntegration.DoesNotExist:
         logger.error(f"No Whoop integration found for user ID {user_id}")
+    except SyncInProgress as e:
+        if webhook:
+            # The running sync may have started before these events arrived, so sync again after it
+            raise self.retry(kwargs={'webhook': False}, countdown=settings.WHOOP_WEBHOOK_COALESCE_WINDOW, exc=e)
+        logger.info(f"Whoop sync already running for user ID {user_id}, skipping")
+    except RateLimitExceeded as e:
+        # Come back when the provider's window has room instead of burning requests on 429s
+        logger.warning(f"Whoop rate limit reached for user ID {user_id}, retrying in {e.retry_after:.0f}s")
+        # The webhook events were claimed by this run, so the retry has to do a windowed sync
+        raise self.retry(kwargs={'webhook': False}, countdown=e.retry_after, exc=e)
     except Exception as e:
-        logger.error(f"Error syncing Whoop data for user ID {user_id}: {str(e)}") 
\ No newline at end of file
+        logger.error(f"Error syncing Whoop data for user ID {user_id}: {str(e)}")
+
+@shared_task(ignore_result=True)
+def refresh_expiring_tokens():
+    """Refresh tokens before they expire so syncs don't have to"""
+    tokens.refresh_expiring_tokens()
+
+@shared_task(ignore_result=True)
+def rollup_sync_runs():
+    """Fold yesterday's sync runs into daily totals and prune the ledger"""
+    ledger.rollup_sync_runs()
+
+def queue_interactive_sync(provider, user_id):
+    """Queue a sync the user is waiting for on the interactive queue and return its task id"""
+    task = sync_strava_user if provider == 'strava' else sync_whoop_user
+    result = task.apply_async(
+        (user_id,),
+        {'lock_wait': settings.SYNC_LOCK_WAIT},
+        queue=settings.INTERACTIVE_SYNC_QUEUE
+    )
+    return result.id
+
+def start_full_resync(user):
+    """
+    Resume the user's unfinished full Strava resync, or start a new one.
+    
+    A job that failed or stopped saving pages is picked up again from its cursor; one that is
+    still making progress is left alone. Each start or resume hands the job to a new task chain,
+    and only the chain the job was last handed to carries on with it.
+    """
+    job = FullResyncJob.objects.filter(user=user).exclude(status='completed').first()
+    stale = timezone.now() - timedelta(seconds=settings.FULL_RESYNC_STALE_AFTER)
+    chain_id = uuid4().hex
+    
+    if job is None:
+        job = FullResyncJob.objects.create(user=user, chain_id=chain_id)
+    elif job.status == 'failed' or job.updated_at < stale:
+        # Only take the job over if nobody else has touched it since we read it, so two
+        # requests resuming the same job cannot both queue a chain
+        resumed = FullResyncJob.objects.filter(id=job.id, status=job.status, updated_at=job.updated_at).update(
+            status='pending', error='', chain_id=chain_id, updated_at=timezone.now()
+        )
+        job.refresh_from_db()
+        if not resumed:
+            return job
+        logger.info(f"Resuming full Strava resync {job.id} for user {user.username} from cursor {job.cursor}")
+    else:
+        return job
+    
+    run_full_resync.delay(job.id, chain_id)
+    return job
+
+@shared_task(bind=True, max_retries=None, acks_late=True, ignore_result=True)
+def run_full_resync(self, job_id, chain_id=''):
+    """
+    Process one page of a full Strava resync, then queue the next page.
+    
+    The counts and the cursor are saved on the job after every batch of activities written, so
+    the worker is free between pages and a crashed or rate-limited job resumes from its last
+    written batch. A task whose chain no longer owns the job, because it was resumed by a new
+    chain, stops without touching it.
+    """
+    try:
+        job = FullResyncJob.objects.select_related('user').get(id=job_id)
+    except FullResyncJob.DoesNotExist:
+        logger.error(f"Full resync job {job_id} not found")
+        return
+    if job.status == 'completed' or job.chain_id != chain_id:
+        return
+    
+    try:
+        service = StravaService(job.user)
+        with IntegrationLease(service.integration.id).hold() as lease:
+            # The job may have moved on while this task waited for the lease
+            job.refresh_from_db()
+            if job.status == 'completed' or job.chain_id != chain_id:
+                logger.info(f"Full resync {job_id} was completed or taken over by another chain, stopping")
+                return
+            service.integration.refresh_from_db()
+            service.refresh_token_if_needed()
+            page = service.fetch_activity_page(job.cursor)
+            page_size = len(page)
+            
+            def on_progress(counts, timestamp, boundary_ids):
+                # Save after every batch so a rate-limited page is retried from where it stopped
+                for key, value in counts.items():
+                    job.counts[key] = job.counts.get(key, 0) + value
+                job.cursor = timestamp - 1
+                job.boundary_ids = boundary_ids
+                job.status = 'running'
+                job.save(update_fields=['counts', 'cursor', 'boundary_ids', 'status', 'updated_at'])
+                lease.extend()
+            
+            # Each page starts one second before the newest activity stored so far, as in
+            # iter_activity_pages; drop the activities from that second that were already processed
+            page = [a for a in page if a.get('id') not in job.boundary_ids]
+            if page:
+                service.process_activity_page(page, on_progress=on_progress)
+                job.pages += 1
+            
+            done = page_size < service.PER_PAGE or not page
+        job.status = 'completed' if done else 'running'
+        if done:
+            job.finished_at = timezone.now()
+        # Finish the page only if no other chain took the job over while it ran
+        if not FullResyncJob.objects.filter(id=job.id, chain_id=chain_id).update(
+            status=job.status, pages=job.pages, finished_at=job.finished_at, updated_at=timezone.now()
+        ):
+            logger.info(f"Full resync {job_id} was taken over by another chain, stopping")
+            return
+    except RateLimitExceeded as e:
+        logger.warning(f"Strava rate limit reached during full resync {job_id}, retrying in {e.retry_after:.0f}s")
+        raise self.retry(countdown=e.retry_after, exc=e)
+    except SyncInProgress as e:
+        # Let the running sync finish, then carry on from the same cursor
+        raise self.retry(countdown=settings.SYNC_LOCK_WAIT, exc=e)
+    except Exception as e:
+        logger.error(f"Error in full Strava resync {job_id} for user {job.user.username}: {str(e)}")
+        FullResyncJob.objects.filter(id=job.id, chain_id=chain_id).update(
+            status='failed', error=str(e), updated_at=timezone.now()
+        )
+        return
+    
+    if done:
+        logger.info(f"Completed full Strava resync {job_id} for user {job.user.username}: {job.pages} pages, {job.counts}")
+    else:
+        run_full_resync.delay(job_id, chain_id)
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from core.models import Activity
+from .http_client import get_client
+from .models import FullResyncJob, UserIntegration
+from .ratelimit import RateLimitExceeded
+from .services.strava import StravaService
+from . import tasks
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.headers = {}
+        self.text = ''
+        self.content = b''
+
+    def json(self):
+        return self.data
+
+class FakeStrava:
+    """
+    Stands in for the Strava API behind ProviderClient.session.
+
+    Serves the summary activities in `activities` oldest first within `after`/`before`, and a
+    detailed record with cadence and calories for each, counting the detail requests made.
+    """
+
+    def __init__(self, activities):
+        self.activities = activities
+        self.detail_calls = []
+        self.detail_status = 200
+
+    def request(self, method, url, params=None, **kwargs):
+        if url.endswith('/athlete/activities'):
+            after = params.get('after') or 0
+            before = params.get('before')
+            page = [
+                dict(activity) for activity in sorted(self.activities, key=StravaService.start_timestamp)
+                if StravaService.start_timestamp(activity) > after
+                and (before is None or StravaService.start_timestamp(activity) < before)
+            ]
+            return FakeResponse(page[:params['per_page']])
+
+        activity_id = int(url.rsplit('/', 1)[1])
+        self.detail_calls.append(activity_id)
+        if self.detail_status != 200:
+            return FakeResponse({}, self.detail_status)
+        return FakeResponse({'average_cadence': 80.0, 'calories': 300.0})
+
+class FakeGovernor:
+    """Allows `calls` provider calls, then raises RateLimitExceeded like an exhausted window"""
+
+    def __init__(self, calls=None):
+        self.calls = calls
+
+    def acquire(self, provider, max_wait=None):
+        if self.calls is not None:
+            if self.calls <= 0:
+                raise RateLimitExceeded(provider, 60)
+            self.calls -= 1
+
+    def observe(self, provider, response):
+        pass
+
+def summary_activities(count, start=datetime(2024, 1, 1, tzinfo=dt_timezone.utc)):
+    """Summary activities with two starting in every hour, so page boundaries split a second"""
+    return [
+        {
+            'id': n,
+            'name': f'Run {n}',
+            'type': 'Run',
+            'start_date': (start + timedelta(hours=n // 2)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'moving_time': 1800,
+            'distance': 5000.0,
+            'has_heartrate': True,
+            'average_heartrate': 140.0,
+        }
+        for n in range(count)
+    ]
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StravaSyncTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='athlete')
+        self.integration = UserIntegration.objects.create(
+            user=self.user,
+            provider='strava',
+            access_token='token',
+            refresh_token='refresh',
+            token_expires_at=timezone.now() + timedelta(days=1)
+        )
+        self.strava = FakeStrava(summary_activities(23))
+        self.governor = FakeGovernor()
+
+        for patcher in (
+            mock.patch.object(get_client('strava').session, 'request', side_effect=self.strava.request),
+            mock.patch('integrations.http_client.get_governor', return_value=self.governor),
+            mock.patch.object(StravaService, 'PER_PAGE', 5),
+            mock.patch.object(StravaService, 'DETAIL_BATCH_SIZE', 3),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sync(self):
+        return StravaService(self.user).sync_activities()
+
+    def stored_ids(self):
+        return sorted(int(external_id) for external_id in Activity.objects.filter(user=self.user).values_list('external_id', flat=True))
+
+    def test_pages_split_within_a_second_store_every_activity_once(self):
+        totals = self.sync()
+
+        self.assertEqual(self.stored_ids(), list(range(23)))
+        self.assertEqual(totals['created'], 23)
+        self.assertEqual(sorted(self.strava.detail_calls), list(range(23)))
+        self.integration.refresh_from_db()
+        self.assertIsNone(self.integration.sync_cursor)
+        self.assertIsNotNone(self.integration.last_sync)
+
+    def test_unchanged_activities_are_skipped(self):
+        self.sync()
+        self.strava.detail_calls.clear()
+        self.strava.activities[7]['distance'] = 6000.0
+
+        totals = StravaService(self.user).resync_activities()
+
+        self.assertEqual(totals['unchanged'], 22)
+        self.assertEqual(totals['updated'], 1)
+        self.assertEqual(totals['created'], 0)
+        self.assertEqual(self.strava.detail_calls, [7])
+        self.assertEqual(Activity.objects.get(user=self.user, external_id='7').distance, 6)
+
+    def test_rate_limited_sync_resumes_from_the_last_written_batch(self):
+        attempts = 0
+        while True:
+            attempts += 1
+            self.governor.calls = 6
+            stored_before = Activity.objects.filter(user=self.user).count()
+            try:
+                self.sync()
+                break
+            except RateLimitExceeded:
+                self.integration.refresh_from_db()
+                self.assertIsNotNone(self.integration.sync_cursor)
+                self.assertGreater(Activity.objects.filter(user=self.user).count(), stored_before)
+            self.assertLess(attempts, 20)
+
+        self.assertGreater(attempts, 1)
+        self.assertEqual(self.stored_ids(), list(range(23)))
+        # Details are fetched again only for the batch that was cut short by each limit
+        self.assertLess(len(self.strava.detail_calls), 23 + attempts * StravaService.DETAIL_BATCH_SIZE)
+        self.assertFalse(Activity.objects.filter(user=self.user, average_cadence__isnull=True).exists())
+
+    def test_activities_whose_details_failed_are_fetched_again(self):
+        self.strava.detail_status = 404
+        self.sync()
+        self.assertEqual(Activity.objects.filter(user=self.user, summary_fingerprint__isnull=True).count(), 23)
+
+        self.strava.detail_status = 200
+        self.strava.detail_calls.clear()
+        StravaService(self.user).resync_activities()
+
+        self.assertEqual(sorted(self.strava.detail_calls), list(range(23)))
+        self.assertFalse(Activity.objects.filter(user=self.user, average_cadence__isnull=True).exists())
+
+    def test_rate_limited_full_resync_resumes_from_its_job(self):
+        chain = []
+        with mock.patch.object(tasks.run_full_resync, 'delay', side_effect=lambda *args: chain.append(args)):
+            job = tasks.start_full_resync(self.user)
+            while chain:
+                self.governor.calls = 6
+                args = chain.pop()
+                try:
+                    tasks.run_full_resync.run(*args)
+                except RateLimitExceeded:
+                    chain.append(args)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.counts['created'], 23)
+        self.assertEqual(self.stored_ids(), list(range(23)))
+
+    def test_superseded_full_resync_chain_stops(self):
+        with mock.patch.object(tasks.run_full_resync, 'delay'):
+            job = tasks.start_full_resync(self.user)
+        FullResyncJob.objects.filter(id=job.id).update(chain_id='other')
+
+        with mock.patch.object(tasks.run_full_resync, 'delay') as delay:
+            tasks.run_full_resync.run(job.id, job.chain_id)
+
+        delay.assert_not_called()
+        self.assertEqual(Activity.objects.filter(user=self.user).count(), 0)
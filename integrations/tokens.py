@@ -0,0 +1,74 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import UserIntegration
+from .scheduler import SYNC_PROVIDERS
+from .services.strava import StravaService
+from .services.whoop import WhoopService
+
+logger = logging.getLogger(__name__)
+
+SERVICES = {
+    'strava': StravaService,
+    'whoop': WhoopService,
+}
+
+def iter_expiring_integrations(now=None, batch_size=None):
+    """
+    Yield batches of integrations whose tokens expire within TOKEN_REFRESH_AHEAD.
+
+    Integrations whose last refresh failed are left out until TOKEN_REFRESH_RETRY_AFTER has
+    passed, so revoked tokens are not retried every run.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.TOKEN_REFRESH_BATCH_SIZE
+    expiring = UserIntegration.objects.filter(
+        Q(token_refresh_failed_at__isnull=True) | Q(token_refresh_failed_at__lte=now - timedelta(seconds=settings.TOKEN_REFRESH_RETRY_AFTER)),
+        provider__in=SYNC_PROVIDERS,
+        token_expires_at__lte=now + timedelta(seconds=settings.TOKEN_REFRESH_AHEAD),
+    ).select_related('user').order_by('id')
+
+    last_id = 0
+    while True:
+        batch = list(expiring.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+def refresh_integration_token(integration):
+    """Refresh one integration's token and record the outcome on it. Called on a refresher thread."""
+    try:
+        service = SERVICES[integration.provider](integration.user, integration=integration)
+        service.refresh_token_if_needed(within=timedelta(seconds=settings.TOKEN_REFRESH_AHEAD), tolerate_failure=False)
+        if integration.token_refresh_failures:
+            UserIntegration.objects.filter(id=integration.id).update(
+                token_refresh_failures=0,
+                token_refresh_error='',
+                token_refresh_failed_at=None
+            )
+        return True
+    except Exception as e:
+        logger.error(f"Error refreshing {integration.provider} token for user {integration.user.username}: {str(e)}")
+        UserIntegration.objects.filter(id=integration.id).update(
+            token_refresh_failures=F('token_refresh_failures') + 1,
+            token_refresh_error=str(e),
+            token_refresh_failed_at=timezone.now()
+        )
+        return False
+    finally:
+        connection.close()
+
+def refresh_expiring_tokens(now=None):
+    """Refresh every token expiring soon, a batch at a time, and return counts of the outcomes"""
+    results = {'refreshed': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=settings.TOKEN_REFRESH_CONCURRENCY, thread_name_prefix='token-refresh') as executor:
+        for batch in iter_expiring_integrations(now):
+            for refreshed in executor.map(refresh_integration_token, batch):
+                results['refreshed' if refreshed else 'failed'] += 1
+    logger.info(f"Token refresher finished: {results}")
+    return results
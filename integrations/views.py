@@ -1,18 +1,18 @@
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.conf import settings
 from django.utils import timezone
-from datetime import datetime, timedelta
-import requests
+from datetime import datetime, timedelta, timezone as dt_timezone
 import json
 import logging
-from .models import UserIntegration
+from .models import FullResyncJob, SyncRun, UserIntegration
+from .http_client import get_client
+from .webhooks import parse_event, queue_whoop_sync
 from core.models import Activity
 from .services.strava import StravaService
-from .services.whoop import WhoopService
-from django.core.management import call_command
-from threading import Thread
+from .tasks import queue_interactive_sync, start_full_resync
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 import secrets
@@ -28,27 +28,47 @@ def generate_state(length=8):
 
 @login_required
 def sync_strava(request):
-    try:
-        service = StravaService(request.user)
-        service.sync_activities()
-        return redirect('activities')
-    except UserIntegration.DoesNotExist:
+    if not request.user_context.integration('strava'):
         return redirect('settings')
-    except Exception as e:
-        logger.error(f"Error syncing Strava activities: {str(e)}")
-        return render(request, 'error.html', {'error': str(e)})
+    # Sync in the background so the request returns right away; the page polls the sync's status
+    task_id = queue_interactive_sync('strava', request.user.id)
+    remember_sync_task(request, task_id)
+    return redirect(f"{reverse('activities')}?sync={task_id}")
 
 @login_required
 def sync_whoop(request):
-    try:
-        service = WhoopService(request.user)
-        service.sync_data()
-        return redirect('metrics')
-    except UserIntegration.DoesNotExist:
+    if not request.user_context.integration('whoop'):
         return redirect('settings')
-    except Exception as e:
-        logger.error(f"Error syncing Whoop data: {str(e)}")
-        return render(request, 'error.html', {'error': str(e)})
+    task_id = queue_interactive_sync('whoop', request.user.id)
+    remember_sync_task(request, task_id)
+    return redirect(f"{reverse('metrics')}?sync={task_id}")
+
+def remember_sync_task(request, task_id):
+    """Keep the user's recent sync task ids in their session so only they can poll them"""
+    task_ids = request.session.get('sync_tasks', [])[-9:]
+    request.session['sync_tasks'] = task_ids + [task_id]
+
+def queued_sync_task(request):
+    """The task id in the request's `sync` parameter if it is one of the user's own queued syncs"""
+    task_id = request.GET.get('sync')
+    return task_id if task_id in request.session.get('sync_tasks', []) else None
+
+@login_required
+def sync_status(request, task_id):
+    """State of a queued sync as JSON"""
+    if task_id not in request.session.get('sync_tasks', []):
+        return JsonResponse({'error': 'Unknown sync'}, status=404)
+    # Sync tasks keep no Celery result; their ledger entry is written when they finish
+    run = SyncRun.objects.filter(task_id=task_id).first()
+    if run is None:
+        return JsonResponse({'status': 'pending', 'done': False})
+    return JsonResponse({
+        'status': run.status,
+        # A rate-limited sync is retried under the same task id
+        'done': run.status != 'rate_limited',
+        'rows_created': run.rows_created,
+        'rows_updated': run.rows_updated,
+    })
 
 @login_required
 def connect_strava(request):
@@ -75,7 +95,7 @@ def complete_strava(request):
             return render(request, 'error.html', {'error': 'No authorization code received from Strava'})
         
         # Exchange the code for an access token
-        response = requests.post(
+        response = get_client('strava').post(
             'https://www.strava.com/oauth/token',
             data={
                 'client_id': settings.SOCIAL_AUTH_STRAVA_KEY,
@@ -99,7 +119,11 @@ def complete_strava(request):
             defaults={
                 'access_token': data.get('access_token'),
                 'refresh_token': data.get('refresh_token'),
-                'token_expires_at': timezone.make_aware(datetime.fromtimestamp(data.get('expires_at', 0)))
+                'token_expires_at': timezone.make_aware(datetime.fromtimestamp(data.get('expires_at', 0))),
+                # Reconnecting replaces any token the refresher gave up on
+                'token_refresh_failures': 0,
+                'token_refresh_error': '',
+                'token_refresh_failed_at': None
             }
         )
         
@@ -116,7 +140,7 @@ def connect_whoop(request):
     """Custom view to handle Whoop authentication"""
     try:
         # Check if already connected
-        if UserIntegration.objects.filter(user=request.user, provider='whoop').exists():
+        if request.user_context.integration('whoop'):
             return redirect('settings')
         
         # Redirect to social auth login
@@ -197,7 +221,7 @@ def complete_whoop(request):
             }
             logger.info(f"Token exchange data: client_id={settings.SOCIAL_AUTH_WHOOP_KEY}, code={code[:5]}..., redirect_uri={redirect_uri}")
             
-            response = requests.post(
+            response = get_client('whoop').post(
                 'https://api.prod.whoop.com/oauth/oauth2/token',
                 data=token_data
             )
@@ -218,7 +242,7 @@ def complete_whoop(request):
         user_id = None
         try:
             # Make a request to get the user profile
-            profile_response = requests.get(
+            profile_response = get_client('whoop').get(
                 'https://api.prod.whoop.com/developer-api/v1/user/profile',
                 headers={
                     'Authorization': f'Bearer {data.get("access_token")}',
@@ -243,7 +267,10 @@ def complete_whoop(request):
                 'access_token': data.get('access_token'),
                 'refresh_token': data.get('refresh_token'),
                 'token_expires_at': timezone.now() + timedelta(seconds=data.get('expires_in', 3600)),
-                'external_id': user_id
+                'external_id': user_id,
+                'token_refresh_failures': 0,
+                'token_refresh_error': '',
+                'token_refresh_failed_at': None
             }
         )
         
@@ -284,27 +311,27 @@ def whoop_webhook(request):
             return HttpResponse("User not found", status=404)
         
         # Process the webhook based on event type
-        event_type = data.get('event_type')
+        event_type = data.get('type') or data.get('event_type')
+        resource_type, resource_id, action = parse_event(data)
         logger.info(f"Processing Whoop webhook event type: {event_type} for user {user.username}")
         
-        # Import the sync task
-        from .tasks import sync_whoop_user
-        
         # Handle different event types
-        if event_type in ['workout', 'sleep', 'recovery', 'cycle']:
-            # Queue a task to sync the specific data type
-            sync_whoop_user.delay(user.id)
-            logger.info(f"Queued Whoop sync for user {user.username} due to {event_type} event")
-        elif event_type == 'user.delete':
+        if event_type == 'user.delete':
             # Handle user deletion event
             logger.info(f"Received user deletion event for Whoop user {data['user_id']}")
             integration.delete()
             logger.info(f"Deleted Whoop integration for user {user.username}")
             return HttpResponse("User integration deleted", status=200)
+        elif resource_type in ['workout', 'sleep', 'recovery', 'cycle']:
+            # Queue a sync of the named resource, folding a burst of events for the user into one
+            if queue_whoop_sync(user.id, (resource_type, resource_id, action)):
+                logger.info(f"Queued Whoop sync for user {user.username} due to {event_type} event")
+            else:
+                logger.info(f"Whoop sync already pending for user {user.username}, absorbed {event_type} event")
         else:
             logger.info(f"Received unknown Whoop event type: {event_type}")
             # Still sync data for unknown event types as a precaution
-            sync_whoop_user.delay(user.id)
+            queue_whoop_sync(user.id)
             logger.info(f"Queued Whoop sync for user {user.username} despite unknown event type")
         
         return HttpResponse("Webhook processed successfully", status=200)
@@ -316,30 +343,14 @@ def whoop_webhook(request):
 @login_required
 def full_resync_strava(request):
     try:
-        # Instead of using subprocess, directly call the resync functionality
-        from django.core.management import call_command
-        from threading import Thread
-        
-        # Set up a background thread to run the command
-        def run_resync():
-            try:
-                # Call the command with the current user only
-                logger.info(f"Starting background resync for user {request.user.username}")
-                call_command('resync_strava_activities', user=request.user.username)
-                logger.info(f"Completed background resync for user {request.user.username}")
-            except Exception as e:
-                logger.error(f"Error in background resync thread: {str(e)}", exc_info=True)
-        
-        # Start the thread
-        thread = Thread(target=run_resync)
-        thread.daemon = True  # This ensures the thread won't block server shutdown
-        thread.start()
-        logger.info(f"Background resync thread started for user {request.user.username}")
+        # Run the resync as a chain of Celery tasks so it survives web worker restarts
+        job = start_full_resync(request.user)
+        logger.info(f"Full resync job {job.id} queued for user {request.user.username}")
         
         # Show a message to the user that the resync has been triggered
         return render(request, 'info.html', {
             'title': 'Full Resync Started',
-            'message': 'A full resync of all your Strava activities has been started. This process may take a few minutes. The heart rate and cadence data will be updated as it becomes available.',
+            'message': 'A full resync of all your Strava activities has been started. This process may take a few minutes. Its progress is shown on the Strava activities page, and the heart rate and cadence data will be updated as it becomes available.',
             'redirect_url': '/strava/',
             'redirect_text': 'Return to Strava Activities'
         })
@@ -347,6 +358,24 @@ def full_resync_strava(request):
         logger.error(f"Error triggering full Strava resync: {str(e)}", exc_info=True)
         return render(request, 'error.html', {'error': str(e)})
 
+@login_required
+def full_resync_status(request):
+    """Progress of the user's latest full Strava resync as JSON"""
+    job = FullResyncJob.objects.filter(user=request.user).first()
+    if job is None:
+        return JsonResponse({'status': None})
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'active': job.active,
+        'pages': job.pages,
+        'counts': job.counts,
+        'synced_through': datetime.fromtimestamp(job.cursor, tz=dt_timezone.utc).isoformat() if job.cursor else None,
+        'error': job.error,
+        'started': job.created_at.isoformat(),
+        'finished': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
 @login_required
 def direct_sync_strava(request):
     """
@@ -364,8 +393,8 @@ def direct_sync_strava(request):
         
         # Make a direct API call to /athlete/activities with no filters
         logger.info("Making direct API call to check for Strava activities")
-        activities_response = requests.get(
-            'https://www.strava.com/api/v3/athlete/activities', 
+        activities_response = get_client('strava').get(
+            'https://www.strava.com/api/v3/athlete/activities',
             headers=headers,
             params={"per_page": 10}  # Get a few recent activities
         )
@@ -390,22 +419,11 @@ def direct_sync_strava(request):
         # Create service
         service = StravaService(request.user)
         
-        # Store current last_sync
-        old_last_sync = integration.last_sync
-        
-        # Set last_sync to None to get all activities (not just new ones)
-        integration.last_sync = None
-        integration.save()
-        
-        # Log what we're doing
-        logger.info(f"Running direct sync for user {request.user.username} with no timestamp filter")
-        
-        # Run the sync
-        results = service.sync_activities()
-        
-        # Restore original last_sync
-        integration.last_sync = old_last_sync
-        integration.save()
+        # Resync only the last 30 days so the request stays short; a windowed sync leaves
+        # last_sync and the cursor alone. Full history goes through start_full_resync.
+        after = int((timezone.now() - timedelta(days=30)).timestamp())
+        logger.info(f"Running direct sync for user {request.user.username} after timestamp {after}")
+        results = service.sync_activities(after=after, lock_wait=settings.SYNC_LOCK_WAIT)
         
         # Check heart rate and cadence data
         total = results['total']
@@ -473,7 +491,7 @@ def strava_diagnostic(request):
         headers = {
             'Authorization': f'Bearer {integration.access_token}'
         }
-        athlete_response = requests.get('https://www.strava.com/api/v3/athlete', headers=headers)
+        athlete_response = get_client('strava').get('https://www.strava.com/api/v3/athlete', headers=headers)
         
         athlete_result = {
             "status_code": athlete_response.status_code,
@@ -481,8 +499,8 @@ def strava_diagnostic(request):
         }
         
         # Step 4: Make a direct API call to /athlete/activities with no filters
-        activities_response = requests.get(
-            'https://www.strava.com/api/v3/athlete/activities', 
+        activities_response = get_client('strava').get(
+            'https://www.strava.com/api/v3/athlete/activities',
             headers=headers,
             params={"per_page": 5}  # Just get a few to check
         )
@@ -509,7 +527,8 @@ def strava_diagnostic(request):
             "token_refresh_result": token_refresh_result,
             "athlete_result": athlete_result,
             "activities_result": activities_result,
-            "scopes": scopes
+            "scopes": scopes,
+            "client_stats": get_client('strava').stats()
         }
         
         # Format results for display
@@ -557,7 +576,7 @@ def strava_debug(request):
         # 1. Test athlete profile
         athlete_url = 'https://www.strava.com/api/v3/athlete'
         logger.info(f"Testing Strava API: {athlete_url}")
-        athlete_response = requests.get(athlete_url, headers=headers)
+        athlete_response = get_client('strava').get(athlete_url, headers=headers)
         athlete_result = {
             'endpoint': 'Athlete Profile',
             'url': athlete_url,
@@ -585,7 +604,7 @@ def strava_debug(request):
         week_ago = int((timezone.now() - timedelta(days=7)).timestamp())
         params_week = {'after': week_ago, 'per_page': 100}
         logger.info(f"Testing Strava API: {activities_url} with params {params_week}")
-        week_response = requests.get(activities_url, headers=headers, params=params_week)
+        week_response = get_client('strava').get(activities_url, headers=headers, params=params_week)
         
         week_result = {
             'endpoint': 'Activities (Last 7 days)',
@@ -616,7 +635,7 @@ def strava_debug(request):
         ninety_days_ago = int((timezone.now() - timedelta(days=90)).timestamp())
         params_ninety = {'after': ninety_days_ago, 'per_page': 100}
         logger.info(f"Testing Strava API: {activities_url} with params {params_ninety}")
-        ninety_response = requests.get(activities_url, headers=headers, params=params_ninety)
+        ninety_response = get_client('strava').get(activities_url, headers=headers, params=params_ninety)
         
         ninety_result = {
             'endpoint': 'Activities (Last 90 days)',
@@ -644,7 +663,7 @@ def strava_debug(request):
         # All time (no after param)
         params_all = {'per_page': 100}
         logger.info(f"Testing Strava API: {activities_url} with params {params_all}")
-        all_response = requests.get(activities_url, headers=headers, params=params_all)
+        all_response = get_client('strava').get(activities_url, headers=headers, params=params_all)
         
         all_result = {
             'endpoint': 'Activities (All time)',
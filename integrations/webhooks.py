@@ -0,0 +1,96 @@
+import logging
+import redis
+from django.conf import settings
+from .redis_store import get_redis
+
+logger = logging.getLogger(__name__)
+
+# How long a pending marker outlives its window, in case the scheduled sync is lost
+PENDING_GRACE = 10 * 60
+
+def pending_key(user_id):
+    return f"whoop:webhook:pending:{user_id}"
+
+def events_key(user_id):
+    return f"whoop:webhook:events:{user_id}"
+
+def unresolved_key(user_id):
+    return f"whoop:webhook:unresolved:{user_id}"
+
+def resources_key(user_id):
+    return f"whoop:webhook:resources:{user_id}"
+
+# Resource types a webhook can name that we can fetch one at a time
+TARGETED_RESOURCES = ('workout', 'sleep', 'recovery')
+
+def parse_event(data):
+    """
+    Get the (resource type, resource id, action) a Whoop webhook payload refers to.
+
+    The resource id is None when the event does not name a single resource we can fetch.
+    """
+    event_type = data.get('type') or data.get('event_type') or ''
+    resource_type, _, action = event_type.partition('.')
+    resource_id = data.get('id')
+    if resource_type not in TARGETED_RESOURCES or resource_id in (None, ''):
+        resource_id = None
+    return resource_type, resource_id, action or 'updated'
+
+def queue_whoop_sync(user_id, resource=None):
+    """
+    Schedule a Whoop sync for a webhook event, folding bursts of events into one sync.
+
+    `resource` is the (type, id, action) the event names, or None if it cannot be resolved to
+    a single resource. The first event for a user schedules a sync at the end of the coalescing
+    window; later events inside the window are only recorded. Returns True if this event
+    scheduled the sync.
+    """
+    from .tasks import sync_whoop_user
+
+    window = settings.WHOOP_WEBHOOK_COALESCE_WINDOW
+    ttl = window + PENDING_GRACE
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(events_key(user_id))
+        pipe.expire(events_key(user_id), ttl)
+        if resource and resource[1] is not None:
+            pipe.sadd(resources_key(user_id), ':'.join(str(part) for part in resource))
+            pipe.expire(resources_key(user_id), ttl)
+        else:
+            pipe.incr(unresolved_key(user_id))
+            pipe.expire(unresolved_key(user_id), ttl)
+        pipe.set(pending_key(user_id), 1, nx=True, ex=ttl)
+        scheduled = pipe.execute()[-1]
+    except redis.RedisError as e:
+        logger.warning(f"Could not coalesce Whoop webhook for user ID {user_id}, syncing now: {str(e)}")
+        sync_whoop_user.delay(user_id)
+        return True
+
+    if scheduled:
+        sync_whoop_user.apply_async((user_id,), {'webhook': True}, countdown=window)
+    return bool(scheduled)
+
+def claim_webhook_events(user_id):
+    """
+    Take the webhook events absorbed by a starting Whoop sync and reopen the window.
+
+    Events that arrive once the sync has started schedule a new one. Returns a dict with the
+    number of events absorbed, the (type, id, action) resources they named, and how many could
+    not be resolved to a single resource.
+    """
+    try:
+        pipe = get_redis().pipeline()
+        pipe.getdel(events_key(user_id))
+        pipe.getdel(unresolved_key(user_id))
+        pipe.smembers(resources_key(user_id))
+        pipe.delete(resources_key(user_id), pending_key(user_id))
+        events, unresolved, resources, _ = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not claim Whoop webhook events for user ID {user_id}: {str(e)}")
+        return {'events': 0, 'resources': [], 'unresolved': 0}
+
+    return {
+        'events': int(events or 0),
+        'resources': sorted(tuple(member.decode().split(':')) for member in resources),
+        'unresolved': int(unresolved or 0),
+    }
@@ -5,7 +5,7 @@ from django.contrib.auth.views import PasswordChangeView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from .models import UserSettings
-from integrations.models import UserIntegration
+from integrations.scheduler import reschedule_user
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .forms import UserPreferencesForm, CustomPasswordChangeForm
@@ -19,21 +19,13 @@ class UserSettingsView(LoginRequiredMixin, UpdateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Check if user has a valid Strava integration
-        try:
-            strava_integration = UserIntegration.objects.get(
-                user=self.request.user,
-                provider='strava'
-            )
-            context['strava_connected'] = True
-            context['strava_last_sync'] = strava_integration.last_sync
-        except UserIntegration.DoesNotExist:
-            context['strava_connected'] = False
-            context['strava_last_sync'] = None
+        strava_integration = self.request.user_context.integration('strava')
+        context['strava_connected'] = strava_integration is not None
+        context['strava_last_sync'] = strava_integration.last_sync if strava_integration else None
         return context
     
     def get_object(self, queryset=None):
-        settings, created = UserSettings.objects.get_or_create(user=self.request.user)
-        return settings
+        return self.request.user_context.settings
 
 class CustomPasswordChangeView(LoginRequiredMixin, PasswordChangeView):
     """Custom password change view with our template and form."""
@@ -54,56 +46,28 @@ class RegisterView(CreateView):
 @login_required
 def settings(request):
     # Get or create user settings
-    user_settings, created = UserSettings.objects.get_or_create(user=request.user)
+    user_settings = request.user_context.settings
     
     if request.method == 'POST':
         form = UserPreferencesForm(request.POST, instance=user_settings)
         if form.is_valid():
             form.save()
+            reschedule_user(request.user, user_settings.sync_frequency)
             messages.success(request, "Settings updated successfully!")
             return redirect('settings')
     else:
         form = UserPreferencesForm(instance=user_settings)
     
-    # Check integration status
-    strava_connected = UserIntegration.objects.filter(
-        user=request.user, 
-        provider='strava'
-    ).exists()
-    
-    whoop_connected = UserIntegration.objects.filter(
-        user=request.user, 
-        provider='whoop'
-    ).exists()
-    
-    strava_last_sync = None
-    if strava_connected:
-        try:
-            strava_integration = UserIntegration.objects.get(
-                user=request.user,
-                provider='strava'
-            )
-            strava_last_sync = strava_integration.last_sync
-        except:
-            pass
-    
-    whoop_last_sync = None
-    if whoop_connected:
-        try:
-            whoop_integration = UserIntegration.objects.get(
-                user=request.user,
-                provider='whoop'
-            )
-            whoop_last_sync = whoop_integration.last_sync
-        except:
-            pass
+    # Check integration status; all of the user's integrations are loaded in one query
+    strava_integration = request.user_context.integration('strava')
+    whoop_integration = request.user_context.integration('whoop')
     
     return render(request, 'settings.html', {
         'form': form,
-        'strava_connected': strava_connected,
-        'whoop_connected': whoop_connected,
-        'strava_last_sync': strava_last_sync,
-        'whoop_last_sync': whoop_last_sync,
+        'strava_connected': strava_integration is not None,
+        'whoop_connected': whoop_integration is not None,
+        'strava_last_sync': strava_integration.last_sync if strava_integration else None,
+        'whoop_last_sync': whoop_integration.last_sync if whoop_integration else None,
     })
 
 @login_required